@@ -6,6 +6,8 @@ from matplotlib import pyplot as plt
 import numpy as np
 import matplotlib.lines as mlines
 
+from traj_io import read_traj
+
 
 def barycenter_distance(d, m1, m2):
     return d * m2 / (m1 + m2)
@@ -33,11 +35,96 @@ COLOR_SC_ORBIT = 'black'
 COLOR_ORBIT_LEO = 'grey'
 COLOR_SOI = 'red'
 
+SAVEFIG_SCALE = 1.5
+SVG_DPI = 72
+
+# path simplification: largest deviation in output pixels for 'auto', and
+# the turn between two segments above which a vertex is always kept, unless
+# its segments are shorter than SIMPLIFY_MIN_SEGMENT tolerances (jitter)
+SIMPLIFY_PIXELS = 0.25
+SIMPLIFY_MAX_TURN = np.radians(2)
+SIMPLIFY_MIN_SEGMENT = 0.1
+
 
 def get_script_folder():
     return os.path.dirname(os.path.abspath(__file__))
 
 
+def read_data_raw(infile):
+    """
+    infile: out.txt text, or .traj binary (memory-mapped), relative to the
+    script folder. Returns the earth_pos, moon_pos and sc_pos (xs, ys).
+    """
+    filename = os.path.join(get_script_folder(), infile)
+
+    if filename.endswith('.traj'):
+        data, _header = read_traj(filename)
+        _time, earth_xs, earth_ys, moon_xs, moon_ys, sc_xs, sc_ys = data.T
+    else:
+        with open(filename, 'r') as f:
+            _header, *data_raw = f.readlines()
+
+        data_parsed = [[int(tup) for tup in line.strip().split()] for line in data_raw]
+        _time, earth_xs, earth_ys, moon_xs, moon_ys, sc_xs, sc_ys = np.array(data_parsed).transpose()
+
+    return {
+        'earth_pos': (earth_xs, earth_ys),
+        'moon_pos': (moon_xs, moon_ys),
+        'sc_pos': (sc_xs, sc_ys),
+    }
+
+
+def turn_angles(xs, ys):
+    """Direction change at each vertex (rad), 0 at both ends."""
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    headings = np.arctan2(dy, dx)
+    turns = np.abs(np.angle(np.exp(1j*np.diff(headings))))
+    return np.concatenate(([0.0], turns, [0.0]))
+
+
+def simplify_path(xs, ys, tolerance, max_turn=SIMPLIFY_MAX_TURN):
+    """
+    Douglas-Peucker: indexes of the vertices to keep so that the polyline
+    stays within tolerance (plot units) of the original. The vertices
+    turning by more than max_turn (perilune, perigee) are always kept, the
+    stretches in between are simplified on their own.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    if n < 3:
+        return np.arange(n)
+
+    segments = np.hypot(np.diff(xs), np.diff(ys))
+    keep = turn_angles(xs, ys) > max_turn
+    keep[1:-1] &= np.minimum(segments[:-1], segments[1:]) >= SIMPLIFY_MIN_SEGMENT*tolerance
+    keep[0] = keep[-1] = True
+    anchors = np.flatnonzero(keep)
+    stack = list(zip(anchors[:-1], anchors[1:]))
+
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx = xs[b] - xs[a]
+        dy = ys[b] - ys[a]
+        px = xs[a+1:b] - xs[a]
+        py = ys[a+1:b] - ys[a]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            d = np.hypot(px, py)
+        else:
+            d = np.abs(dx*py - dy*px) / length
+        i = np.argmax(d)
+        if d[i] > tolerance:
+            m = a + 1 + i
+            keep[m] = True
+            stack += [(a, m), (m, b)]
+
+    return np.flatnonzero(keep)
+
+
 class Plot(object):
     def __init__(self, config):
         """
@@ -45,8 +132,11 @@ class Plot(object):
             TODO
             xlim
             ylim
-            infile
+            infile: out.txt text, or .traj binary (memory-mapped)
             outfile
+            simplify: optional, simplify the lines before plotting them,
+                tolerance in plot units or 'auto', SIMPLIFY_PIXELS of the
+                output resolution
         """
         self.config = config
         self.data_raw = {}
@@ -60,17 +150,7 @@ class Plot(object):
             self.load_data_raw(config['infile'])
 
     def load_data_raw(self, infile):
-        with open('%s\\%s' % (get_script_folder(), infile), 'r') as f:
-            _header, *data_raw = f.readlines()
-
-        data_parsed = [[int(tup) for tup in line.strip().split()] for line in data_raw]
-        _time, earth_xs, earth_ys, moon_xs, moon_ys, sc_xs, sc_ys = np.array(data_parsed).transpose()
-
-        self.data_raw = {
-            'earth_pos': (earth_xs, earth_ys),
-            'moon_pos': (moon_xs, moon_ys),
-            'sc_pos': (sc_xs, sc_ys),
-        }
+        self.data_raw = read_data_raw(infile)
 
     def go(self):
         print('=== %s ===' % self.config['outfile'])
@@ -90,13 +170,41 @@ class Plot(object):
     def plot(self):
         pass
 
+    def simplify_tolerance(self):
+        """config['simplify'] in plot units, None when off; after configure_axis."""
+        simplify = self.config.get('simplify')
+        if not simplify:
+            return None
+        if simplify != 'auto':
+            return float(simplify)
+
+        # plot units per output pixel, the larger of both axes with the
+        # equal aspect
+        outfile = self.config.get('outfile', '')
+        dpi = SVG_DPI if outfile.endswith('.svg') else self.fig.dpi
+        box = self.ax.get_position()
+        xlim = self.ax.get_xlim()
+        ylim = self.ax.get_ylim()
+        width = box.width * SAVEFIG_SCALE*self.figsizex * dpi
+        height = box.height * SAVEFIG_SCALE*self.figsizey * dpi
+        return SIMPLIFY_PIXELS * max((xlim[1]-xlim[0]) / width, (ylim[1]-ylim[0]) / height)
+
+    def simplify(self, xs, ys):
+        """(xs, ys) simplified with config['simplify'], as is when off."""
+        tolerance = self.simplify_tolerance()
+        if tolerance is None:
+            return xs, ys
+        kept = simplify_path(xs, ys, tolerance)
+        print('simplify: %d -> %d vertices (%.1fx), tolerance %.0f' % (
+            len(xs), len(kept), len(xs) / max(1, len(kept)), tolerance))
+        return np.asarray(xs)[kept], np.asarray(ys)[kept]
+
     def configure_axis(self):
         ax = self.ax
         figsizex = self.figsizex
         figsizey = self.figsizey
         xlim = self.config['xlim']
         ylim = self.config['ylim']
-        param = self.config['param']
 
         # configure size
 
@@ -130,10 +238,11 @@ class Plot(object):
         ax.set_ylabel('Unit: 1000 km')
 
 
-    def savefig(self):
-        scale = 1.5
+    def savefig(self, outfile=None):
+        """outfile: default config['outfile'], relative to the script folder"""
+        scale = SAVEFIG_SCALE
 
         plt.rcParams['svg.hashsalt'] = 'constantseed'  # https://github.com/matplotlib/matplotlib/pull/7748
 
         self.fig.set_size_inches((scale*self.figsizex, scale*self.figsizey))
-        self.fig.savefig('%s/%s' % (get_script_folder(), self.config['outfile']), bbox_inches='tight')
+        self.fig.savefig('%s/%s' % (get_script_folder(), outfile or self.config['outfile']), bbox_inches='tight')
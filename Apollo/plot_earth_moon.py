@@ -23,6 +23,11 @@ of 145 hrs 04 min.
 
 '''
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+
 from matplotlib import pyplot as plt
 from plot_common import (
     EARTH_RADIUS,
@@ -32,8 +37,20 @@ from plot_common import (
     COLOR_MOON_ORBIT,
     COLOR_SC_ORBIT,
     Plot,
+    get_script_folder,
+    read_data_raw,
 )
 
+COLOR_NAMES = ['red','blue','yellow','green','purple','black','orange','green','aqua','brown','peru','pink','navy','seagreen','tan','darkgreen']
+SIM_DAY = 10
+
+FAMILY_CONFIG = {
+    'xlim': (-40*10**6, 450*10**6),
+    'ylim': (-390*10**6, 400*10**6),
+    'point_plotted': SIM_DAY * 86400/50,
+    'show_moon_orbit': True,
+}
+
 
 class PlotFreeReturn(Plot):
     def data_prepare(self):
@@ -49,8 +66,13 @@ class PlotFreeReturn(Plot):
         print('plot %d/%d points' % (self.config['point_plotted'], len(self.data_raw['earth_pos'][0])))
 
     def plot(self):
+        _earth_xs, _earth_ys, _moon_xs, _moon_ys, sc_xs, sc_ys = self.data_prepared
+        self.plot_static()
+        self.plot_spacecraft(sc_xs, sc_ys, self.config['color'], self.config['param'])
+
+    def plot_static(self):
         ax = self.ax
-        earth_xs, earth_ys, moon_xs, moon_ys, sc_xs, sc_ys = self.data_prepared
+        earth_xs, earth_ys, moon_xs, moon_ys, _sc_xs, _sc_ys = self.data_prepared
 
         # orbit: sc initial
         # ax.add_artist(plt.Circle((earth_xs[0], earth_ys[0]), EARTH_RADIUS+185*1000, edgecolor=COLOR_ORBIT_LEO, facecolor='none'))
@@ -60,57 +82,143 @@ class PlotFreeReturn(Plot):
         ax.add_artist(plt.Circle((moon_xs[0], moon_ys[0]), MOON_RADIUS, color=COLOR_MOON))
 
         # trajectories
-        # plt.plot(earth_xs, earth_ys, '-', color=COLOR_EARTH_ORBIT)
+        # ax.plot(earth_xs, earth_ys, '-', color=COLOR_EARTH_ORBIT)
         if self.config['show_moon_orbit']:
-            plt.plot(moon_xs, moon_ys, '-', color=COLOR_MOON_ORBIT)
-        plt.plot(sc_xs, sc_ys,  color = self.config['color'], label = self.config['param'])
-        plt.grid(True)
-
-# THRUST
-colorLine = 1
-colorName = ['red','blue','yellow','green','purple','black','orange','green','aqua','brown','peru','pink','navy','seagreen','tan','darkgreen']
-simDay = 10
-angle = -123.7
-colorLine = 1
-for deltaV in range(3145, 3155, 2):
-	baseFile = 'deltav\\out_' + str(angle) + '_' + str(deltaV) + '.0'
-	inFile = baseFile + '.txt'
-	outFile = baseFile + '.svg'
-	parValue = 'ΔV = ' + str(deltaV) + ' α = ' + str(angle)
-	conf = {
-		'xlim': (-40*10**6, 450*10**6),
-		'ylim': (-390*10**6, 400*10**6),
-		'infile': inFile,
-		'outfile': outFile,
-		'point_plotted': simDay * 86400/50,
-		'show_moon_orbit': True,
-		'param': parValue,
-		'color': colorName[colorLine]
-	}
-	p = PlotFreeReturn (conf)
-	p.go()
-	colorLine = colorLine + 1
-p.display('Free Return Trajectory for different ΔV from LEO 100 nm after T = 10 days')
-
-# ANGLE
-colorLine = 1
-for angle in range(111, 133, 2):
-    deltaV = 3150
-    baseFile = 'angle\\out_-' + str(angle) + '.7_' + str(deltaV) + '.0'
-    inFile = baseFile + '.txt'
-    outFile = baseFile + '.svg'
-    parValue = 'ΔV = ' + str(deltaV) + ' α = ' + str(angle) + '.7'	
-    conf = {
-        'xlim': (-40*10**6, 450*10**6),
-        'ylim': (-390*10**6, 400*10**6),
-        'infile': inFile,
-        'outfile': outFile,
-        'point_plotted': simDay * 86400/50,
-        'show_moon_orbit': True,
-        'param': parValue,
-        'color': colorName[colorLine]
-    }
-    p = PlotFreeReturn (conf)
-    p.go()
-    colorLine = colorLine + 1
-p.display('Free Return Trajectory for different α from LEO 100 nm after T = 10 days')
+            ax.plot(*self.simplify(moon_xs, moon_ys), '-', color=COLOR_MOON_ORBIT)
+        ax.grid(True)
+
+    def plot_spacecraft(self, sc_xs, sc_ys, color, label):
+        line, = self.ax.plot(*self.simplify(sc_xs, sc_ys), color=color, label=label)
+        return line
+
+
+class PlotFreeReturnFamily(PlotFreeReturn):
+    """
+    A family of free-return trajectories, the runs of one angle or ΔV
+    sweep, on a figure of its own: the files are loaded once, the axes,
+    Earth, Moon and lunar orbit drawn once, each output only swaps the
+    spacecraft line.
+
+    config: as PlotFreeReturn without infile, outfile, param and color, plus
+        members: list of {infile, outfile, param, color}
+    """
+    def __init__(self, config):
+        plt.figure()
+        super().__init__(config)
+        self.members = config['members']
+        self.family = [read_data_raw(member['infile']) for member in self.members]
+        self.data_raw = self.family[0]
+
+    def data_prepare(self):
+        super().data_prepare()
+        n = int(self.config['point_plotted'])
+        self.sc_prepared = [(data['sc_pos'][0][:n], data['sc_pos'][1][:n]) for data in self.family]
+
+    def go(self):
+        self.data_prepare()
+        self.configure_axis()
+        self.plot_static()
+
+        line = None
+        for (member, (sc_xs, sc_ys)) in zip(self.members, self.sc_prepared):
+            print('=== %s ===' % member['outfile'])
+            if line is None:
+                line = self.plot_spacecraft(sc_xs, sc_ys, member['color'], member['param'])
+            else:
+                line.set_data(*self.simplify(sc_xs, sc_ys))
+                line.set_color(member['color'])
+                line.set_label(member['param'])
+            self.savefig(member['outfile'])
+
+        if line is not None:
+            line.remove()
+
+    def display(self, title):
+        # all the family together
+        for (member, (sc_xs, sc_ys)) in zip(self.members, self.sc_prepared):
+            self.plot_spacecraft(sc_xs, sc_ys, member['color'], member['param'])
+        super().display(title)
+
+
+def family_members(folder):
+    """
+    {infile, outfile, param, color} of the out_<angle>_<dv>.txt or .traj
+    files of a sweep folder (relative to the script folder), .traj first
+    when both exist, none if the folder does not exist. Returns (members,
+    title).
+    """
+    runs = {}
+    path = os.path.join(get_script_folder(), folder)
+    for filename in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        match = re.match(r'out_(-?[0-9.]+)_(-?[0-9.]+)\.(txt|traj)$', filename)
+        if match and (match.group(3) == 'traj' or filename[:-4] not in runs):
+            runs[os.path.splitext(filename)[0]] = (float(match.group(1)), float(match.group(2)), filename)
+
+    runs = sorted(runs.values(), key=lambda run: (run[1], abs(run[0])))
+    angles = set(angle for (angle, _dv, _filename) in runs)
+    dvs = set(dv for (_angle, dv, _filename) in runs)
+    varying = 'ΔV' if len(dvs) > 1 and len(angles) == 1 else 'α'
+
+    members = []
+    for (i, (angle, dv, filename)) in enumerate(runs):
+        infile = os.path.join(folder, filename)
+        members.append({
+            'infile': infile,
+            'outfile': os.path.splitext(infile)[0] + '.svg',
+            'param': 'ΔV = %g α = %g' % (dv, angle),
+            'color': COLOR_NAMES[1 + i % (len(COLOR_NAMES)-1)],
+        })
+    return members, 'Free Return Trajectory for different %s from LEO 100 nm after T = %d days' % (varying, SIM_DAY)
+
+
+def _render(config):
+    plt.switch_backend('Agg')
+    PlotFreeReturnFamily(config).go()
+
+
+def render_family(config, jobs=1):
+    """Renders the members of config, spread on jobs processes."""
+    members = config['members']
+    jobs = min(jobs, len(members))
+    if jobs <= 1:
+        family = PlotFreeReturnFamily(config)
+        family.go()
+        return family
+
+    # each worker loads its share of the family and builds its own figure
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(_render, [dict(config, members=members[i::jobs]) for i in range(jobs)]))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="One SVG per trajectory of the sweep folders, plus their overlay")
+    parser.add_argument('folders', nargs='*', default=['deltav', 'angle', 'grid'],
+                        help="sweep folders, relative to the script folder (default: %(default)s, the sim-sweep.py"
+                             " output folders)")
+    parser.add_argument('--jobs', type=int, default=1, help="worker processes (default: %(default)s)")
+    parser.add_argument('--no-show', action='store_true', help="only write the SVGs, no overlay window")
+    parser.add_argument('--simplify', default='auto',
+                        help="line simplification tolerance in plot units (m), 'auto' for a fraction of an output"
+                             " pixel, 0 to plot every sample (default: %(default)s)")
+    args = parser.parse_args()
+
+    for folder in args.folders:
+        members, title = family_members(folder)
+        if not members:
+            print('%s: no trajectory' % folder)
+            continue
+        simplify = args.simplify if args.simplify == 'auto' else float(args.simplify)
+        config = dict(FAMILY_CONFIG, members=members, simplify=simplify)
+        family = render_family(config, args.jobs)
+        if not args.no_show:
+            if family is None:
+                family = PlotFreeReturnFamily(config)
+                family.data_prepare()
+                family.configure_axis()
+                family.plot_static()
+            family.display(title)
+
+
+if __name__ == '__main__':
+    main()
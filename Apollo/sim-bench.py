@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''
+Benchmark and accuracy check of the free-return engines, on canonical
+cases (-123.7°, 3150 m/s by default):
+
+    python sim-bench.py                                   -> bench.json
+    python sim-bench.py --sps 1 10 100 --engines array cr3bp
+    python sim-bench.py --compare bench-old.json
+
+Every case runs in a process of its own, for its peak memory (max RSS).
+Recorded per case: wall time, steps and steps/s, peak memory, the relative
+drift of the Earth-Moon energy (not with cr3bp, where they are fixed), the
+drift of the spacecraft Jacobi constant (exact invariant of cr3bp only)
+and the final spacecraft position error against a high accuracy rk45 run
+of the same model (array for the reference and array engines).
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+from sim_adaptive import (
+    RTOL,
+    run_rk45,
+)
+from sim_common import (
+    ANGULAR_SPEED,
+    EARTH,
+    MOON,
+    SIM_DURATION,
+    SPACECRAFT,
+    export_steps,
+    make_bodies,
+    make_engine,
+    run_array,
+    run_reference,
+)
+
+ANGLE = -123.7
+DV = 3150.0
+REFERENCE_RTOL = 1e-13
+
+
+def bodies_state(bodies):
+    pos = np.array([(b.pos.x, b.pos.y) for b in bodies])
+    vel = np.array([(b.vel.x, b.vel.y) for b in bodies])
+    mu = np.array([b.mu for b in bodies])
+    return pos, vel, mu
+
+
+def earth_moon_energy(pos, vel, mu):
+    """Energy of the Earth-Moon pair per G (the masses are mu/G)."""
+    kinetic = sum(mu[b]*(vel[b] @ vel[b])/2 for b in (EARTH, MOON))
+    return kinetic - mu[EARTH]*mu[MOON] / np.hypot(*(pos[MOON] - pos[EARTH]))
+
+
+def jacobi_constant(pos, vel, mu, frame_angular_speed):
+    """Spacecraft Jacobi constant in the frame rotating at ANGULAR_SPEED about the origin."""
+    n = ANGULAR_SPEED
+    r = pos[SPACECRAFT]
+    v = vel[SPACECRAFT]
+    if not frame_angular_speed:
+        v = v + n*np.array([r[1], -r[0]])
+    potential = sum(mu[b] / np.hypot(*(r - pos[b])) for b in (EARTH, MOON))
+    return n*n*(r @ r) + 2*potential - v @ v
+
+
+def run_case(engine, integrator, sim_step_per_sec, sim_duration, rtol):
+    """
+    One run in the current process. Returns its record, with the last
+    spacecraft sample for the position error.
+    """
+    earth, moon, spacecraft = make_bodies(ANGLE, DV)
+
+    if engine == 'reference':
+        pos0, vel0, mu = bodies_state((earth, moon, spacecraft))
+        frame_angular_speed = 0.0
+        t_start = time.perf_counter()
+        samples = run_reference(earth, moon, spacecraft, sim_step_per_sec, sim_duration)
+        wall = time.perf_counter() - t_start
+        pos, vel, mu = bodies_state((earth, moon, spacecraft))
+        steps = export_steps(sim_step_per_sec, sim_duration)[1]
+    else:
+        state = make_engine(engine, earth, moon, spacecraft)
+        pos0, vel0, mu = state.pos.copy(), state.vel.copy(), state.mu
+        frame_angular_speed = state.frame_angular_speed
+        t_start = time.perf_counter()
+        if integrator == 'rk45':
+            samples, stats = run_rk45(state, sim_duration, rtol, first_step=1.0 / sim_step_per_sec)
+            steps = stats['steps']
+        else:
+            samples = run_array(state, sim_step_per_sec, sim_duration)
+            steps = export_steps(sim_step_per_sec, sim_duration)[1]
+        wall = time.perf_counter() - t_start
+        pos, vel = state.pos, state.vel
+
+    record = {
+        'engine': engine,
+        'integrator': integrator,
+        'sim_step_per_sec': sim_step_per_sec,
+        'rtol': rtol if integrator == 'rk45' else None,
+        'wall_s': wall,
+        'steps': int(steps),
+        'steps_per_s': steps / wall,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'energy_drift': None,
+        'jacobi_drift': None,
+    }
+    if not frame_angular_speed:
+        e0 = earth_moon_energy(pos0, vel0, mu)
+        record['energy_drift'] = abs(earth_moon_energy(pos, vel, mu) - e0) / abs(e0)
+    c0 = jacobi_constant(pos0, vel0, mu, frame_angular_speed)
+    record['jacobi_drift'] = abs(jacobi_constant(pos, vel, mu, frame_angular_speed) - c0) / abs(c0)
+
+    last = samples[-1]
+    return record, (last[0], last[1+2*SPACECRAFT], last[2+2*SPACECRAFT])
+
+
+def run_isolated(*args):
+    # a fresh process per case: its max RSS is the peak of that case only
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, old):
+    """Prints the wall time and position error ratios against an older report."""
+    key = lambda r: (r['engine'], r['integrator'], r['sim_step_per_sec'])
+    old_cases = dict((key(r), r) for r in old['cases'])
+    print("\nAgainst %s (%s)" % (old.get('commit'), old.get('date')))
+    for r in report['cases']:
+        o = old_cases.get(key(r))
+        if o:
+            print("\t%-9s %-5s %6g sps: wall x%.2f, position error %.0f m -> %.0f m" % (
+                r['engine'], r['integrator'], r['sim_step_per_sec'], r['wall_s'] / o['wall_s'],
+                o['position_error_m'], r['position_error_m']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sps', type=float, nargs='+', default=[1, 10],
+                        help="sim_step_per_sec values of the Euler runs (default: %(default)s)")
+    parser.add_argument('--engines', nargs='+', choices=('reference', 'array', 'cr3bp'),
+                        default=['reference', 'array', 'cr3bp'])
+    parser.add_argument('--no-rk45', action='store_true', help="only the Euler runs")
+    parser.add_argument('--rtol', type=float, default=RTOL, help="rk45 runs tolerance (default: %(default)s)")
+    parser.add_argument('--duration', type=float, default=SIM_DURATION, help="s (default: %(default)s)")
+    parser.add_argument('--report', default='bench.json', help="JSON report (default: %(default)s)")
+    parser.add_argument('--compare', help="older JSON report to compare with")
+    args = parser.parse_args()
+
+    cases = [(engine, 'euler', sps) for engine in args.engines for sps in args.sps]
+    if not args.no_rk45:
+        cases += [(engine, 'rk45', 1.0) for engine in args.engines if engine != 'reference']
+
+    # high accuracy solution of each model, the reference engine runs the array one
+    models = sorted(set('cr3bp' if engine == 'cr3bp' else 'array' for (engine, _i, _sps) in cases))
+    references = {}
+    for model in models:
+        print("reference %s rk45 rtol %g" % (model, REFERENCE_RTOL))
+        _record, references[model] = run_case(model, 'rk45', 1.0, args.duration, REFERENCE_RTOL)
+
+    records = []
+    for (engine, integrator, sps) in cases:
+        record, (t, x, y) = run_isolated(engine, integrator, sps, args.duration, args.rtol)
+        t_ref, x_ref, y_ref = references['cr3bp' if engine == 'cr3bp' else 'array']
+        assert t == t_ref, "the runs end on different samples"
+        record['position_error_m'] = math.hypot(x - x_ref, y - y_ref)
+        records.append(record)
+        print("%-9s %-5s %6g sps: %8.2f s, %10.0f steps/s, %6.1f MB, position error %10.0f m, jacobi drift %.2e" % (
+            engine, integrator, sps, record['wall_s'], record['steps_per_s'], record['peak_rss_mb'],
+            record['position_error_m'], record['jacobi_drift']))
+
+    report = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'case': {'injection_angle_deg': ANGLE, 'injection_dv': DV, 'sim_duration': args.duration},
+        'reference_rtol': REFERENCE_RTOL,
+        'cases': records,
+    }
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("report: %s" % args.report)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
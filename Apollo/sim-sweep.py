@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+'''
+Free-return sweep over (injection angle, ΔV) pairs, in a single process:
+all the spacecraft of a batch share the same Earth/Moon integration and are
+propagated together, batches can be spread on several processes.
+
+Replaces simu_angle.sh / simu_deltav.sh, same out_<angle>_<dv>.txt files
+(or .traj with --format traj):
+
+    python sim-sweep.py --angle-range -131.7 -123.7 2 --dv 3150        -> angle/
+    python sim-sweep.py --angle -123.7 --dv-range 3145 3155 1          -> deltav/
+    python sim-sweep.py --angle-range -140 -110 0.5 --dv-range 3100 3200 5 --jobs 8
+    python sim-sweep.py --pairs pairs.txt --outdir grid
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import time
+
+from sim_common import (
+    OUTPUT_FORMATS,
+    case_samples,
+    run_batch,
+    write_samples,
+)
+from sim_events import (
+    EVENTS,
+    EventDetector,
+    make_events,
+    write_events,
+)
+
+
+def inclusive_range(first, last, step):
+    # like seq: first, first+step, ..., last included
+    n = int(round((last - first) / step)) + 1
+    return [round(first + i*step, 6) for i in range(n)]
+
+
+def read_pairs(filename):
+    pairs = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                angle, dv = line.replace(',', ' ').split()
+                pairs.append((float(angle), float(dv)))
+    return pairs
+
+
+def default_outdir(pairs):
+    angles = set(angle for (angle, _dv) in pairs)
+    dvs = set(dv for (_angle, dv) in pairs)
+    if len(dvs) == 1 and len(angles) > 1:
+        return 'angle'
+    if len(angles) == 1:
+        return 'deltav'
+    return 'grid'
+
+
+def case_basename(outdir, angle, dv):
+    return os.path.join(outdir, 'out_%.1f_%.1f' % (angle, dv))
+
+
+def run_cases(batch, sim_step_per_sec, outdir, output_format, event_names, stop, engine='array'):
+    """
+    batch: (case index, (angle, dv)) list.
+    Returns the event records, with the case index of the whole sweep.
+    """
+    indexes = [index for (index, _pair) in batch]
+    pairs = [pair for (_index, pair) in batch]
+    detector = EventDetector(make_events(event_names, stop), len(pairs)) if event_names else None
+
+    samples = run_batch(pairs, sim_step_per_sec, detector=detector, engine=engine)
+
+    for (i, (angle, dv)) in enumerate(pairs):
+        params = {
+            'injection_angle_deg': angle,
+            'injection_dv': dv,
+            'sim_step_per_sec': sim_step_per_sec,
+            'engine': engine,
+            'integrator': 'euler',
+        }
+        write_samples(case_basename(outdir, angle, dv), case_samples(samples, i), output_format, params)
+
+    if not detector:
+        return []
+    return [r._replace(case=indexes[r.case]) for r in detector.records]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--angle', type=float, nargs='+', default=[], help="injection angles (deg)")
+    parser.add_argument('--angle-range', type=float, nargs=3, metavar=('FIRST', 'LAST', 'STEP'))
+    parser.add_argument('--dv', type=float, nargs='+', default=[], help="injection ΔV (m/s)")
+    parser.add_argument('--dv-range', type=float, nargs=3, metavar=('FIRST', 'LAST', 'STEP'))
+    parser.add_argument('--pairs', help="file with one 'angle dv' pair per line, instead of the angle x ΔV grid")
+    parser.add_argument('--sim-step-per-sec', type=float, default=10)
+    parser.add_argument('--engine', choices=('array', 'cr3bp'), default='array',
+                        help="'cr3bp': Earth and Moon fixed in the rotating frame (default: %(default)s)")
+    parser.add_argument('--outdir', help="default: angle/ or deltav/ when only one of them varies, else grid/")
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help="spacecraft propagated together, bounds the memory (default: %(default)s)")
+    parser.add_argument('--jobs', type=int, default=1, help="worker processes (default: %(default)s)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='txt',
+                        help="out_<angle>_<dv>.txt or .traj, binary (default: %(default)s)")
+    parser.add_argument('--events', nargs='+', choices=EVENTS, default=[],
+                        help="events to detect, all cases in <outdir>/events.txt; moon_impact, entry_interface"
+                             " and escape stop the spacecraft")
+    parser.add_argument('--no-stop', action='store_true', help="record the events without stopping")
+    args = parser.parse_args()
+
+    if args.pairs:
+        pairs = read_pairs(args.pairs)
+    else:
+        angles = args.angle + (inclusive_range(*args.angle_range) if args.angle_range else [])
+        dvs = args.dv + (inclusive_range(*args.dv_range) if args.dv_range else [])
+        if not angles or not dvs:
+            parser.error("give --pairs or at least one angle and one ΔV")
+        pairs = list(itertools.product(angles, dvs))
+
+    outdir = args.outdir or default_outdir(pairs)
+    os.makedirs(outdir, exist_ok=True)
+
+    print("Sweep")
+    print("\tcases: %d" % len(pairs))
+    print("\tsim_step_per_sec: %.3f" % args.sim_step_per_sec)
+    print("\tengine: %s" % args.engine)
+    print("\toutdir: %s" % outdir)
+    print("\tevents: %s" % (' '.join(args.events) or '-'))
+    print("")
+
+    cases = list(enumerate(pairs))
+    batches = [cases[i:i+args.batch_size] for i in range(0, len(cases), args.batch_size)]
+    # fewer batches than workers: split the cases over all of them instead
+    if args.jobs > 1 and len(batches) < args.jobs:
+        n = min(args.jobs, len(cases))
+        batches = [cases[i::n] for i in range(n)]
+
+    t_start = time.time()
+    done = 0
+    records = []
+    run_args = (args.sim_step_per_sec, outdir, args.format, args.events, not args.no_stop, args.engine)
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [(len(b), pool.submit(run_cases, b, *run_args)) for b in batches]
+            for (n, future) in futures:
+                records += future.result()
+                done += n
+                print("%d/%d cases, %.1f s" % (done, len(pairs), time.time() - t_start))
+    else:
+        for b in batches:
+            records += run_cases(b, *run_args)
+            done += len(b)
+            print("%d/%d cases, %.1f s" % (done, len(pairs), time.time() - t_start))
+
+    if args.events:
+        records.sort(key=lambda r: (r.case, r.t))
+        write_events(os.path.join(outdir, 'events.txt'), records, pairs)
+
+
+if __name__ == '__main__':
+    main()
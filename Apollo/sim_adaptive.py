@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+Adaptive-step integration for the free-return simulator: Dormand-Prince
+5(4) with error control and its 4th order dense output, so the samples
+are still exported at exactly EXPORT_DT whatever the step.
+
+The step grows to hours in the coasting arcs and shrinks near the
+perigee/perilune passages, where the fixed step of the semi-implicit Euler
+has to be small for the whole flight.
+'''
+
+import numpy as np
+
+from sim_common import (
+    EXPORT_DT,
+    SIM_DURATION,
+    SPACECRAFT,
+    rotate_samples,
+)
+
+RTOL = 1e-10
+ATOL = 1e-6  # m and m/s
+
+#
+# Dormand-Prince 5(4) tableau
+#
+
+C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+A = [
+    np.array([]),
+    np.array([1/5]),
+    np.array([3/40, 9/40]),
+    np.array([44/45, -56/15, 32/9]),
+    np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+    np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]),
+]
+B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+# 5th minus 4th order weights, last one on the FSAL stage
+E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+# dense output: y(t + theta*h) = y + h * K.T @ P @ (theta, theta^2, theta^3, theta^4)
+P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+])
+
+SAFETY = 0.9
+MIN_FACTOR = 0.2
+MAX_FACTOR = 10.0
+
+
+class DenseStep(object):
+    """One accepted step, [t, t+h], with its dense output."""
+    def __init__(self, t, h, y, K):
+        self.t = t
+        self.h = h
+        self.y = y
+        self.Q = K.T @ P
+
+    def __call__(self, ts):
+        """States at times ts in [t, t+h], one row per time."""
+        theta = (np.asarray(ts) - self.t) / self.h
+        powers = np.cumprod(np.repeat(theta[:, None], 4, axis=1), axis=1)
+        return self.y + self.h * (powers @ self.Q.T)
+
+
+class DormandPrince(object):
+    """
+    Integrates the whole ArrayEngine (or CR3BPEngine) state, y = (pos, vel)
+    flattened.
+
+    stats: accepted/rejected steps, force evaluations and the error
+    estimate, the sum of the local error estimates on the spacecraft
+    position (m), per case.
+    cases: case index of each spacecraft row still integrated
+    """
+    def __init__(self, engine, rtol=RTOL, atol=ATOL, first_step=1.0):
+        self.engine = engine
+        self.rtol = rtol
+        self.atol = atol
+        self.h = first_step
+
+        self.n_pos = engine.pos.size
+        self.t = 0.0
+        self.y = np.concatenate((engine.pos.ravel(), engine.vel.ravel()))
+        self.f = self.fun(self.y)
+        self.cases = np.arange(engine.n_spacecraft())
+
+        self.stats = {
+            'steps': 0,
+            'rejected': 0,
+            'force_evals': 1,
+            'error_estimate': np.zeros(engine.n_spacecraft()),
+        }
+
+    def fun(self, y):
+        pos = y[:self.n_pos].reshape(-1, 2)
+        vel = y[self.n_pos:].reshape(-1, 2)
+        return np.concatenate((y[self.n_pos:], self.engine.accelerations(pos, vel).ravel()))
+
+    def step(self):
+        """Advances by one accepted step, returns its DenseStep."""
+        t, y, h = self.t, self.y, self.h
+        K = np.empty((7, y.size))
+        K[0] = self.f
+
+        while True:
+            for i in range(1, 6):
+                K[i] = self.fun(y + h * (A[i] @ K[:i]))
+            y_new = y + h * (B @ K[:6])
+            K[6] = self.fun(y_new)
+            self.stats['force_evals'] += 6
+
+            err = h * (E @ K)
+            scale = self.atol + self.rtol * np.maximum(np.abs(y), np.abs(y_new))
+            err_norm = np.sqrt(np.mean((err / scale)**2))
+
+            if err_norm <= 1.0:
+                break
+
+            self.stats['rejected'] += 1
+            h *= max(MIN_FACTOR, SAFETY * err_norm**-0.2)
+
+        dense = DenseStep(t, h, y, K)
+
+        sc_err = err[:self.n_pos].reshape(-1, 2)[SPACECRAFT:]
+        self.stats['error_estimate'][self.cases] += np.hypot(sc_err[:, 0], sc_err[:, 1])
+        self.stats['steps'] += 1
+
+        self.t = t + h
+        self.y = y_new
+        self.f = K[6]
+        factor = MAX_FACTOR if err_norm == 0 else SAFETY * err_norm**-0.2
+        self.h = h * min(MAX_FACTOR, max(MIN_FACTOR, factor))
+        return dense
+
+    def remove_spacecraft(self, rows):
+        self.store()
+        self.engine.remove_spacecraft(rows)
+        self.cases = np.delete(self.cases, rows)
+        self.n_pos = self.engine.pos.size
+        self.y = np.concatenate((self.engine.pos.ravel(), self.engine.vel.ravel()))
+        self.f = self.fun(self.y)
+        self.stats['force_evals'] += 1
+
+    def store(self):
+        self.engine.pos[:] = self.y[:self.n_pos].reshape(-1, 2)
+        self.engine.vel[:] = self.y[self.n_pos:].reshape(-1, 2)
+
+
+def run_rk45(engine, sim_duration=SIM_DURATION, rtol=RTOL, atol=ATOL, first_step=1.0, detector=None):
+    """
+    Same samples as sim_common.run_array, exported at exactly i*EXPORT_DT
+    from the dense output. Returns (samples, stats).
+
+    detector: optional sim_events.EventDetector, checked after every step.
+    A spacecraft stopped by an event is exported up to the event.
+    """
+    ts = np.arange(0, sim_duration, EXPORT_DT, dtype=np.float64)
+    samples = np.full((len(ts), 1+engine.pos.size), np.nan)
+    samples[:, 0] = ts
+
+    integrator = DormandPrince(engine, rtol, atol, first_step)
+    samples[0, 1:] = integrator.y[:integrator.n_pos]
+    if detector:
+        detector.start(engine.pos, engine.vel, engine.frame_angular_speed)
+    i = 1
+
+    while i < len(ts) and len(integrator.cases):
+        t0 = integrator.t
+        dense = integrator.step()
+        n_pos = integrator.n_pos
+
+        stopped = {}
+        if detector:
+            y = integrator.y
+            locate = detector.dense_locator(dense, n_pos)
+            stopped = detector.check(t0, integrator.t, y[:n_pos].reshape(-1, 2), y[n_pos:].reshape(-1, 2), locate)
+
+        j = np.searchsorted(ts, integrator.t, 'right')
+        if j > i:
+            pos = dense(ts[i:j])[:, :n_pos].reshape(j-i, -1, 2)
+            samples[i:j, 1:1+2*SPACECRAFT] = pos[:, :SPACECRAFT].reshape(j-i, -1)
+            for (row, case) in enumerate(integrator.cases):
+                n = np.searchsorted(ts[i:j], stopped[row], 'right') if row in stopped else j-i
+                col = 1 + 2*(SPACECRAFT+case)
+                samples[i:i+n, col:col+2] = pos[:n, SPACECRAFT+row]
+            i = j
+
+        if stopped:
+            integrator.remove_spacecraft(sorted(stopped))
+            detector.remove(sorted(stopped))
+
+    if detector:
+        # the run ended early: drop the samples after the last spacecraft stopped
+        filled = np.flatnonzero(~np.all(np.isnan(samples[:, 1+2*SPACECRAFT:]), axis=1))
+        samples = samples[:filled[-1]+1]
+
+    integrator.store()
+    if not engine.frame_angular_speed:
+        rotate_samples(samples, samples[:, 0])
+    return samples, integrator.stats
@@ -0,0 +1,744 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+
+from traj_io import write_traj
+
+#
+# Const
+#
+
+G = 6.67408*10**-11
+
+EARTH_MASS = 5.97237*10**24
+EARTH_RADIUS = 6.378*10**6
+MOON_MASS = 7.342*10**22
+# MOON_RADIUS = 1.737*10**6
+EARTH_MOON_D = 3.84402 * 10**8
+
+ANGULAR_SPEED = 2*math.pi / (27.3*86400)  # rad/sec
+
+SIM_DURATION = 10.0*86400
+INJECTION_ALTITUDE = 185*1000  # 100 nm (Apollo 16-17: 90 nm)
+
+EXPORT_DT = 50
+EXPORT_DT_MS = EXPORT_DT*1000.0
+
+# rows of the state arrays
+EARTH = 0
+MOON = 1
+SPACECRAFT = 2
+
+# columns of the exported samples, same order as out.txt
+SAMPLE_COLUMNS = ('t', 'earth_x', 'earth_y', 'moon_x', 'moon_y', 'spacecraft_x', 'spacecraft_y')
+
+ENGINES = ('array', 'reference', 'cr3bp')
+INTEGRATORS = ('euler', 'rk45')
+OUTPUT_FORMATS = ('txt', 'traj')
+
+# below this many spacecraft the numpy call overhead of a batched step
+# costs more than integrating Earth and Moon again for each spacecraft
+BATCH_MIN_SPACECRAFT = 16
+
+#
+# Helpers
+#
+
+def deg2rad(angle):
+    return angle*math.pi/180.0
+
+#
+# Vector
+#
+
+class Vector(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    @staticmethod
+    def from_polar_rad(magnitude, angle):
+        return Vector(
+            magnitude*math.cos(angle),
+            magnitude*math.sin(angle),
+        )
+
+    def magnitude(self):
+        return math.sqrt(self.x**2 + self.y**2)
+
+    def rotate(self, r):
+        return Vector(
+            r[0][0]*self.x + r[0][1]*self.y,
+            r[1][0]*self.x + r[1][1]*self.y,
+        )
+
+    def __repr__(self):
+        return 'Vector(%s, %s)' % (self.x, self.y)
+
+    def __add__(self, other):
+        if isinstance(other, Vector):
+            return Vector(self.x+other.x, self.y+other.y)
+        elif isinstance(other, int):
+            return Vector(self.x+other, self.y+other)
+        else:
+            raise Exception('Error, I do not know how to add Vector and "%s"' % other.__class__.__name__)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        assert isinstance(other, Vector)
+        return Vector(self.x-other.x, self.y-other.y)
+
+    def __mul__(self, other):
+        assert isinstance(other, (int, float))
+        return Vector(self.x*other, self.y*other)
+
+    def __div__(self, other):
+        assert isinstance(other, (int, float))
+        return Vector(self.x/other, self.y/other)
+
+    def __truediv__(self, other):
+        assert isinstance(other, (int, float))
+        return Vector(self.x/other, self.y/other)
+
+
+class Body(object):
+    def __init__(self, mass, pos, vel):
+        self.mass = mass
+        self.mu = G*mass
+        self.pos = pos
+        self.vel = vel
+        self.acc = Vector(0, 0)
+
+    def update_acc(self, others):
+        a = Vector(0, 0)
+
+        for other in others:
+            dpos = other.pos - self.pos
+
+            # grav_force = G*self.mass*other.mass / dpos.magnitude()**2
+            # grav_acc = grav_force / self.mass
+            grav_acc = G * self.mass * other.mass / dpos.magnitude()**2 / self.mass
+            angle = math.atan2(dpos.y, dpos.x)
+            a += Vector.from_polar_rad(grav_acc, angle)
+
+        self.acc = a
+
+    def update_state(self, _others, sim_dt):
+        self.vel += self.acc*sim_dt
+        self.pos += self.vel*sim_dt
+
+
+#
+# Array engine
+#
+
+class ArrayEngine(object):
+    """
+    Earth, Moon and spacecraft state kept in contiguous float64 arrays.
+
+    pos, vel: (2+N, 2) arrays, rows EARTH, MOON, then N spacecraft from row SPACECRAFT
+    mu: G*mass of each row
+
+    The spacecraft are test particles: like in the reference loop they feel
+    Earth and Moon but do not attract them (nor each other), so any number
+    of them can share the same Earth/Moon integration.
+
+    frame_angular_speed: rotation of the frame of the state, 0 (inertial)
+    here, the samples are rotated to the Moon frame on export.
+    """
+    frame_angular_speed = 0.0
+
+    def __init__(self, pos, vel, mu):
+        self.pos = np.ascontiguousarray(pos, dtype=np.float64)
+        self.vel = np.ascontiguousarray(vel, dtype=np.float64)
+        self.mu = np.ascontiguousarray(mu, dtype=np.float64)
+
+    @staticmethod
+    def from_bodies(earth, moon, *spacecraft):
+        bodies = (earth, moon) + spacecraft
+        return ArrayEngine(
+            [(b.pos.x, b.pos.y) for b in bodies],
+            [(b.vel.x, b.vel.y) for b in bodies],
+            [b.mu for b in bodies],
+        )
+
+    def n_spacecraft(self):
+        return len(self.pos) - SPACECRAFT
+
+    def probe(self, rows, pos, vel):
+        """A new engine of the same kind on the given rows of (pos, vel)."""
+        return type(self)(pos[rows], vel[rows], self.mu[rows])
+
+    def remove_spacecraft(self, rows):
+        """Drops spacecraft rows (0 for the first spacecraft) from the state."""
+        keep = np.ones(len(self.pos), dtype=bool)
+        keep[SPACECRAFT + np.asarray(rows, dtype=np.int64)] = False
+        self.pos = self.pos[keep]
+        self.vel = self.vel[keep]
+        self.mu = self.mu[keep]
+
+    def accelerations(self, pos=None, vel=None):
+        """
+        Vectorised accelerations for a (2+N, 2) position array (default: the
+        current state), used by the integrators working on whole arrays.
+        vel is only used by the rotating frame of CR3BPEngine.
+        """
+        pos = self.pos if pos is None else pos
+        mu = self.mu
+        acc = np.empty_like(pos)
+
+        d = pos[MOON] - pos[EARTH]
+        r2 = d @ d
+        k = 1.0 / (r2*math.sqrt(r2))
+        acc[EARTH] = mu[MOON]*k*d
+        acc[MOON] = -mu[EARTH]*k*d
+
+        d = pos[EARTH] - pos[SPACECRAFT:]
+        r2 = np.einsum('ij,ij->i', d, d)
+        acc[SPACECRAFT:] = (mu[EARTH] / (r2*np.sqrt(r2)))[:, None]*d
+        d = pos[MOON] - pos[SPACECRAFT:]
+        r2 = np.einsum('ij,ij->i', d, d)
+        acc[SPACECRAFT:] += (mu[MOON] / (r2*np.sqrt(r2)))[:, None]*d
+        return acc
+
+    def advance(self, n_steps, sim_dt):
+        """
+        Semi-implicit Euler, same update order as Body.update_acc/update_state,
+        with accelerations as mu*r/|r|^3 instead of atan2/cos/sin.
+        """
+        if self.n_spacecraft() >= BATCH_MIN_SPACECRAFT:
+            self._advance_batch(n_steps, sim_dt)
+            return
+
+        for row in range(SPACECRAFT, len(self.pos)):
+            rows = [EARTH, MOON, row]
+            pos = self.pos[rows]
+            vel = self.vel[rows]
+            self._advance_single(pos, vel, n_steps, sim_dt)
+            self.pos[row] = pos[SPACECRAFT]
+            self.vel[row] = vel[SPACECRAFT]
+
+        self.pos[:SPACECRAFT] = pos[:SPACECRAFT]
+        self.vel[:SPACECRAFT] = vel[:SPACECRAFT]
+
+    def _advance_single(self, pos, vel, n_steps, sim_dt):
+        # pos, vel: (3, 2) Earth, Moon, one spacecraft, updated in place.
+        # The state is unpacked to locals for the inner loop and stored back
+        # into the arrays at the end: at 3 bodies a numpy call per step costs
+        # more than the arithmetic it replaces.
+        mu_e = float(self.mu[EARTH])
+        mu_m = float(self.mu[MOON])
+        (ex, ey), (mx, my), (sx, sy) = pos.tolist()
+        (evx, evy), (mvx, mvy), (svx, svy) = vel.tolist()
+        sqrt = math.sqrt
+        dt = sim_dt
+
+        for _ in range(n_steps):
+            # Earth <-> Moon
+            dx = mx - ex
+            dy = my - ey
+            r2 = dx*dx + dy*dy
+            k = 1.0 / (r2*sqrt(r2))
+            aex = mu_m*k*dx
+            aey = mu_m*k*dy
+            amx = -mu_e*k*dx
+            amy = -mu_e*k*dy
+
+            # spacecraft <- Earth, Moon
+            dx = ex - sx
+            dy = ey - sy
+            r2 = dx*dx + dy*dy
+            k = mu_e / (r2*sqrt(r2))
+            asx = k*dx
+            asy = k*dy
+            dx = mx - sx
+            dy = my - sy
+            r2 = dx*dx + dy*dy
+            k = mu_m / (r2*sqrt(r2))
+            asx += k*dx
+            asy += k*dy
+
+            evx += aex*dt
+            evy += aey*dt
+            ex += evx*dt
+            ey += evy*dt
+            mvx += amx*dt
+            mvy += amy*dt
+            mx += mvx*dt
+            my += mvy*dt
+            svx += asx*dt
+            svy += asy*dt
+            sx += svx*dt
+            sy += svy*dt
+
+        pos[:] = ((ex, ey), (mx, my), (sx, sy))
+        vel[:] = ((evx, evy), (mvx, mvy), (svx, svy))
+
+    def _advance_batch(self, n_steps, sim_dt):
+        # Earth and Moon stay scalar like in _advance_single, the spacecraft
+        # are advanced together as (2, N) arrays with preallocated buffers.
+        mu_e = float(self.mu[EARTH])
+        mu_m = float(self.mu[MOON])
+        (ex, ey), (mx, my) = self.pos[:SPACECRAFT].tolist()
+        (evx, evy), (mvx, mvy) = self.vel[:SPACECRAFT].tolist()
+        sqrt = math.sqrt
+        dt = sim_dt
+
+        s = self.pos[SPACECRAFT:].T.copy()
+        v = self.vel[SPACECRAFT:].T.copy()
+        p = np.empty((2, 1))
+        d = np.empty_like(s)
+        a = np.empty_like(s)
+        r2 = np.empty(s.shape[1])
+        k = np.empty_like(r2)
+
+        for _ in range(n_steps):
+            # Earth <-> Moon
+            dx = mx - ex
+            dy = my - ey
+            q2 = dx*dx + dy*dy
+            q = 1.0 / (q2*sqrt(q2))
+            aex = mu_m*q*dx
+            aey = mu_m*q*dy
+            amx = -mu_e*q*dx
+            amy = -mu_e*q*dy
+
+            # spacecraft <- Earth, Moon
+            for (px, py, mu) in ((ex, ey, mu_e), (mx, my, mu_m)):
+                p[0, 0] = px
+                p[1, 0] = py
+                np.subtract(p, s, out=d)
+                np.multiply(d[0], d[0], out=r2)
+                np.multiply(d[1], d[1], out=k)
+                r2 += k
+                np.sqrt(r2, out=k)
+                k *= r2
+                np.divide(mu, k, out=k)
+                d *= k
+                if mu is mu_e:
+                    a[:] = d
+                else:
+                    a += d
+
+            evx += aex*dt
+            evy += aey*dt
+            ex += evx*dt
+            ey += evy*dt
+            mvx += amx*dt
+            mvy += amy*dt
+            mx += mvx*dt
+            my += mvy*dt
+            a *= dt
+            v += a
+            np.multiply(v, dt, out=a)
+            s += a
+
+        self.pos[:SPACECRAFT] = ((ex, ey), (mx, my))
+        self.vel[:SPACECRAFT] = ((evx, evy), (mvx, mvy))
+        self.pos[SPACECRAFT:] = s.T
+        self.vel[SPACECRAFT:] = v.T
+
+
+class CR3BPEngine(ArrayEngine):
+    """
+    Circular restricted three body problem, in the frame rotating with the
+    Moon at ANGULAR_SPEED: Earth and Moon are fixed on the x axis, where
+    make_bodies puts them, and only the spacecraft are integrated, with the
+    centrifugal and Coriolis terms. The samples come out directly in the
+    exported frame.
+
+    Same state layout as ArrayEngine, the Earth and Moon rows keep zero
+    velocity.
+    """
+    frame_angular_speed = ANGULAR_SPEED
+
+    @staticmethod
+    def from_bodies(earth, moon, *spacecraft):
+        n = ANGULAR_SPEED
+        bodies = (earth, moon) + spacecraft
+        # inertial to rotating velocity: v - w x r, zero for Earth and Moon
+        return CR3BPEngine(
+            [(b.pos.x, b.pos.y) for b in bodies],
+            [(0.0, 0.0), (0.0, 0.0)] + [(b.vel.x + n*b.pos.y, b.vel.y - n*b.pos.x) for b in spacecraft],
+            [b.mu for b in bodies],
+        )
+
+    def accelerations(self, pos=None, vel=None):
+        pos = self.pos if pos is None else pos
+        vel = self.vel if vel is None else vel
+        n = self.frame_angular_speed
+        mu = self.mu
+        acc = np.zeros_like(pos)
+
+        s = pos[SPACECRAFT:]
+        v = vel[SPACECRAFT:]
+        for body in (EARTH, MOON):
+            d = pos[body] - s
+            r2 = np.einsum('ij,ij->i', d, d)
+            acc[SPACECRAFT:] += (mu[body] / (r2*np.sqrt(r2)))[:, None]*d
+        acc[SPACECRAFT:, 0] += n*n*s[:, 0] + 2*n*v[:, 1]
+        acc[SPACECRAFT:, 1] += n*n*s[:, 1] - 2*n*v[:, 0]
+        return acc
+
+    def _advance_single(self, pos, vel, n_steps, sim_dt):
+        # Semi-implicit Euler with the Coriolis term on the start of step velocity
+        mu_e = float(self.mu[EARTH])
+        mu_m = float(self.mu[MOON])
+        (ex, ey), (mx, my), (sx, sy) = pos.tolist()
+        svx, svy = vel[SPACECRAFT].tolist()
+        n2 = self.frame_angular_speed**2
+        two_n = 2*self.frame_angular_speed
+        sqrt = math.sqrt
+        dt = sim_dt
+
+        for _ in range(n_steps):
+            dx = ex - sx
+            dy = ey - sy
+            r2 = dx*dx + dy*dy
+            k = mu_e / (r2*sqrt(r2))
+            asx = k*dx + n2*sx + two_n*svy
+            asy = k*dy + n2*sy - two_n*svx
+            dx = mx - sx
+            dy = my - sy
+            r2 = dx*dx + dy*dy
+            k = mu_m / (r2*sqrt(r2))
+            asx += k*dx
+            asy += k*dy
+
+            svx += asx*dt
+            svy += asy*dt
+            sx += svx*dt
+            sy += svy*dt
+
+        pos[SPACECRAFT] = (sx, sy)
+        vel[SPACECRAFT] = (svx, svy)
+
+    def _advance_batch(self, n_steps, sim_dt):
+        n2 = self.frame_angular_speed**2
+        two_n = 2*self.frame_angular_speed
+        dt = sim_dt
+
+        s = self.pos[SPACECRAFT:].T.copy()
+        v = self.vel[SPACECRAFT:].T.copy()
+        primaries = [(self.pos[body][:, None].copy(), float(self.mu[body])) for body in (EARTH, MOON)]
+        d = np.empty_like(s)
+        a = np.empty_like(s)
+        r2 = np.empty(s.shape[1])
+        k = np.empty_like(r2)
+
+        for _ in range(n_steps):
+            np.multiply(s, n2, out=a)
+            a[0] += two_n*v[1]
+            a[1] -= two_n*v[0]
+            for (p, mu) in primaries:
+                np.subtract(p, s, out=d)
+                np.multiply(d[0], d[0], out=r2)
+                np.multiply(d[1], d[1], out=k)
+                r2 += k
+                np.sqrt(r2, out=k)
+                k *= r2
+                np.divide(mu, k, out=k)
+                d *= k
+                a += d
+
+            a *= dt
+            v += a
+            np.multiply(v, dt, out=a)
+            s += a
+
+        self.pos[SPACECRAFT:] = s.T
+        self.vel[SPACECRAFT:] = v.T
+
+
+#
+# Funcs
+#
+
+def barycenter_distance(d, m1, m2):
+    return d * m2 / (m1 + m2)
+
+
+def orbital_speed(mass, distance):
+    return math.sqrt(G*mass/abs(distance))
+
+
+def make_bodies(injection_angle_deg, injection_dv):
+    """
+    Earth and Moon on circular orbits around the barycenter, spacecraft at
+    TLI cutoff, INJECTION_ALTITUDE above the Earth.
+    """
+    injection_angle = deg2rad(injection_angle_deg)
+
+    earth_pos = Vector(-barycenter_distance(EARTH_MOON_D, EARTH_MASS, MOON_MASS), 0)
+    moon_pos = Vector(+barycenter_distance(EARTH_MOON_D, MOON_MASS, EARTH_MASS), 0)
+    spacecraft_pos = earth_pos + Vector.from_polar_rad(EARTH_RADIUS+INJECTION_ALTITUDE, injection_angle)
+
+    earth_vel = Vector.from_polar_rad(earth_pos.magnitude()*ANGULAR_SPEED, -math.pi/2)
+    moon_vel = Vector.from_polar_rad(moon_pos.magnitude()*ANGULAR_SPEED, math.pi/2)
+    sc_s = orbital_speed(EARTH_MASS, (spacecraft_pos-earth_pos).magnitude()) + injection_dv
+    spacecraft_vel = Vector.from_polar_rad(sc_s, injection_angle+math.pi/2)
+
+    earth = Body(EARTH_MASS, earth_pos, earth_vel)
+    moon = Body(MOON_MASS, moon_pos, moon_vel)
+    spacecraft = Body(
+        1,
+        spacecraft_pos,
+        spacecraft_vel,
+    )
+    return earth, moon, spacecraft
+
+
+def export_steps(sim_step_per_sec, sim_duration=SIM_DURATION):
+    """
+    Returns (steps, n_steps): steps[i] is the index of the simulation step
+    after which export sample i is taken, n_steps the number of steps of
+    the whole run.
+
+    The reference loop accumulates sim_dt_ms in a float, so with a step
+    that does not divide EXPORT_DT_MS the exports drift by whole steps:
+    the same sum is replayed here, in chunks, to keep the same schedule.
+    """
+    sim_dt_ms = 1000.0 / sim_step_per_sec
+    t_max_ms = sim_duration * 1000.0
+
+    assert EXPORT_DT_MS >= sim_dt_ms, "sim_dt_ms must be lower than EXPORT_DT_MS"
+
+    chunk = 1 << 20
+    steps = []
+    last_export_ms = 0.0
+    offset = 0
+    start_ms = 0.0
+
+    while True:
+        sim_ms = np.full(chunk+1, sim_dt_ms)
+        sim_ms[0] = start_ms
+        sim_ms = np.cumsum(sim_ms)
+        n_valid = int(np.searchsorted(sim_ms[:chunk], t_max_ms, 'left'))
+
+        while n_valid and last_export_ms <= sim_ms[n_valid-1]:
+            steps.append(offset + int(np.searchsorted(sim_ms[:n_valid], last_export_ms, 'left')))
+            last_export_ms += EXPORT_DT_MS
+
+        if n_valid < chunk:
+            return np.array(steps, dtype=np.int64), offset + n_valid
+
+        offset += chunk
+        start_ms = sim_ms[chunk]
+
+
+def rotate_samples(samples, sim_ts):
+    """
+    In place, from the inertial frame to the frame rotating with the Moon;
+    sim_ts are the simulation times (s) of the samples, every (x, y) column
+    pair after the time column is rotated.
+    """
+    alpha = -ANGULAR_SPEED*np.asarray(sim_ts)
+    c = np.cos(alpha)[:, None]
+    s = np.sin(alpha)[:, None]
+    xs = samples[:, 1::2].copy()
+    ys = samples[:, 2::2]
+    samples[:, 1::2] = c*xs - s*ys
+    samples[:, 2::2] = s*xs + c*ys
+
+
+def run_reference(earth, moon, spacecraft, sim_step_per_sec, sim_duration=SIM_DURATION):
+    """
+    The original Vector/Body loop, kept as reference for the faster engines.
+    Returns the export samples, one row per EXPORT_DT, columns SAMPLE_COLUMNS.
+    """
+    sim_dt = 1.0 / sim_step_per_sec
+    sim_dt_ms = 1000.0 / sim_step_per_sec
+    t_max_ms = sim_duration * 1000.0
+
+    assert EXPORT_DT_MS >= sim_dt_ms, "sim_dt_ms must be lower than EXPORT_DT_MS"
+
+    last_sim_ms = 0
+    last_export_ms = 0
+
+    poss = []
+
+    while last_sim_ms < t_max_ms:
+        earth.update_acc([moon])
+        moon.update_acc([earth])
+        spacecraft.update_acc([earth, moon])
+
+        earth.update_state([moon], sim_dt)
+        moon.update_state([earth], sim_dt)
+        spacecraft.update_state([earth, moon], sim_dt)
+
+        if last_sim_ms >= last_export_ms:
+            alpha = -ANGULAR_SPEED * last_sim_ms/1000.0
+            r = [
+                [math.cos(alpha), -math.sin(alpha)],
+                [math.sin(alpha), math.cos(alpha)]
+            ]
+
+            poss.append((
+                earth.pos.rotate(r),
+                moon.pos.rotate(r),
+                spacecraft.pos.rotate(r),
+            ))
+
+            last_export_ms += EXPORT_DT_MS
+
+        last_sim_ms += sim_dt_ms
+
+    samples = np.empty((len(poss), len(SAMPLE_COLUMNS)))
+    samples[:, 0] = np.arange(len(poss))*EXPORT_DT
+    samples[:, 1:] = [(ep.x, ep.y, mp.x, mp.y, scp.x, scp.y) for (ep, mp, scp) in poss]
+    return samples
+
+
+def run_array(engine, sim_step_per_sec, sim_duration=SIM_DURATION, detector=None):
+    """
+    Same run as run_reference on an ArrayEngine. The steps after the last
+    export sample are skipped since nothing observes them.
+
+    With N spacecraft the samples have 1+2*(2+N) columns: t, Earth, Moon,
+    then one (x, y) pair per spacecraft; see case_samples.
+
+    detector: optional sim_events.EventDetector, checked on every export
+    interval. A spacecraft stopped by an event gets NaN samples from there
+    on, the run ends when none is left.
+
+    A CR3BPEngine is already in the exported frame, its samples are not
+    rotated.
+    """
+    sim_dt = 1.0 / sim_step_per_sec
+    steps, _n_steps = export_steps(sim_step_per_sec, sim_duration)
+    n_cases = engine.n_spacecraft()
+
+    samples = np.full((len(steps), 1+2*(SPACECRAFT+n_cases)), np.nan)
+    samples[:, 0] = np.arange(len(steps))*EXPORT_DT
+    cases = np.arange(n_cases)
+    if detector:
+        detector.start(engine.pos, engine.vel, engine.frame_angular_speed)
+
+    done = 0
+    for (i, step) in enumerate(steps):
+        if detector:
+            pos0, vel0 = engine.pos.copy(), engine.vel.copy()
+        engine.advance(step+1 - done, sim_dt)
+
+        if detector:
+            locate = detector.euler_locator(pos0, vel0, engine, sim_dt)
+            stopped = detector.check(done*sim_dt, (step+1)*sim_dt, engine.pos, engine.vel, locate)
+            if stopped:
+                engine.remove_spacecraft(sorted(stopped))
+                detector.remove(sorted(stopped))
+            cases = detector.cases
+            if not len(cases):
+                samples = samples[:i]
+                break
+        done = step+1
+
+        samples[i, 1:1+2*SPACECRAFT] = engine.pos[:SPACECRAFT].ravel()
+        cols = 1 + 2*(SPACECRAFT+cases)
+        samples[i, cols] = engine.pos[SPACECRAFT:, 0]
+        samples[i, cols+1] = engine.pos[SPACECRAFT:, 1]
+
+    if not engine.frame_angular_speed:
+        rotate_samples(samples, steps[:len(samples)]*sim_dt)
+    return samples
+
+
+def case_samples(samples, i):
+    """
+    The SAMPLE_COLUMNS view of spacecraft i in a batched run_array result,
+    up to its last sample if an event stopped it.
+    """
+    col = 1 + 2*(SPACECRAFT+i)
+    rows = ~np.isnan(samples[:, col])
+    return np.concatenate((samples[rows, :1+2*SPACECRAFT], samples[rows, col:col+2]), axis=1)
+
+
+def make_engine(engine, earth, moon, *spacecraft):
+    """engine: 'array' or 'cr3bp', the engines working on whole arrays."""
+    if engine == 'array':
+        return ArrayEngine.from_bodies(earth, moon, *spacecraft)
+    if engine == 'cr3bp':
+        return CR3BPEngine.from_bodies(earth, moon, *spacecraft)
+    raise ValueError('Unknown engine "%s", expected one of %s' % (engine, ', '.join(ENGINES)))
+
+
+def run_batch(cases, sim_step_per_sec, sim_duration=SIM_DURATION, detector=None, engine='array'):
+    """
+    cases: (injection_angle_deg, injection_dv) pairs, all propagated
+    together on the same Earth/Moon integration.
+    Returns the batched samples of run_array.
+    """
+    bodies = [make_bodies(angle, dv) for (angle, dv) in cases]
+    earth, moon, _spacecraft = bodies[0]
+    engine = make_engine(engine, earth, moon, *[sc for (_e, _m, sc) in bodies])
+    return run_array(engine, sim_step_per_sec, sim_duration, detector)
+
+
+def run(injection_angle_deg, injection_dv, sim_step_per_sec, engine='array', sim_duration=SIM_DURATION,
+        integrator='euler', rtol=None, events=None):
+    """
+    integrator: 'euler', the fixed sim_step_per_sec semi-implicit Euler of
+    the reference loop, or 'rk45', adaptive Dormand-Prince on the array
+    engine starting with a 1/sim_step_per_sec step (see sim_adaptive).
+    engine: 'array', 'cr3bp' (CR3BPEngine, Earth and Moon fixed in the
+    rotating frame) or 'reference', the original loop, Euler only.
+    events: optional sim_events.Event list, not with the reference engine.
+
+    Returns (samples, stats), stats with the step and force evaluation
+    counts, for rk45 the error estimate and with events their records.
+    """
+    earth, moon, spacecraft = make_bodies(injection_angle_deg, injection_dv)
+
+    detector = None
+    if events:
+        if engine == 'reference':
+            raise ValueError('Events need the array or cr3bp engine')
+        # imported here, sim_events and sim_adaptive build on this module
+        from sim_events import EventDetector
+        detector = EventDetector(events, 1)
+
+    if integrator == 'rk45':
+        if engine == 'reference':
+            raise ValueError('The rk45 integrator needs the array or cr3bp engine')
+        from sim_adaptive import RTOL, run_rk45
+        samples, stats = run_rk45(make_engine(engine, earth, moon, spacecraft), sim_duration,
+                                  rtol=rtol or RTOL, first_step=1.0 / sim_step_per_sec, detector=detector)
+    elif integrator == 'euler':
+        steps, n_steps = export_steps(sim_step_per_sec, sim_duration)
+        if engine == 'reference':
+            samples = run_reference(earth, moon, spacecraft, sim_step_per_sec, sim_duration)
+        else:
+            samples = run_array(make_engine(engine, earth, moon, spacecraft), sim_step_per_sec, sim_duration,
+                                detector)
+            # a terminal event ends the run after the last exported interval
+            if len(samples) < len(steps):
+                n_steps = steps[len(samples)] + 1
+        stats = {'steps': n_steps, 'force_evals': n_steps}
+    else:
+        raise ValueError('Unknown integrator "%s", expected one of %s' % (integrator, ', '.join(INTEGRATORS)))
+
+    if detector:
+        stats['events'] = detector.records
+    return samples, stats
+
+
+def write_text(filename, samples):
+    np.savetxt(filename, samples, fmt='%.0f', header=' '.join(SAMPLE_COLUMNS), comments='')
+
+
+def write_samples(basename, samples, output_format='txt', params=None):
+    """
+    Writes <basename>.txt or <basename>.traj, the binary format of traj_io
+    with the run parameters in its header. Returns the file name.
+    """
+    filename = '%s.%s' % (basename, output_format)
+    if output_format == 'txt':
+        write_text(filename, samples)
+    elif output_format == 'traj':
+        write_traj(filename, samples, SAMPLE_COLUMNS, params)
+    else:
+        raise ValueError('Unknown output format "%s", expected one of %s' % (output_format, ', '.join(OUTPUT_FORMATS)))
+    return filename
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+'''
+Events of the free-return simulation: Moon impact, entry interface,
+perilune/perigee passages and escape. Each event is a function of the
+state that changes sign on the crossing; the integrators check it after
+every export interval (Euler) or step (rk45) and locate the root inside.
+
+Terminal events stop the spacecraft that triggered them: a single run
+ends there, in a batch the spacecraft is dropped from the engine.
+
+Perilune and perigee passages count only APSIS_MIN_TIME after the start:
+the injection velocity has a small radial component, so its sign change
+right after injection (an Euler run records a "perigee" at t = 1 s) is not
+an apsis of the trajectory. The shortest half orbit, around the Earth at
+the altitude of the parking orbit, is about 45 min.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from sim_common import (
+    EARTH,
+    EARTH_MASS,
+    EARTH_RADIUS,
+    G,
+    MOON,
+    MOON_MASS,
+    SPACECRAFT,
+)
+
+MOON_RADIUS = 1.737*10**6
+ENTRY_INTERFACE_ALTITUDE = 121920  # 400 000 ft
+ESCAPE_RADIUS = 1.5*10**9  # about the Earth Hill sphere
+
+ROOT_XTOL = 1e-3  # s
+APSIS_MIN_TIME = 600  # s, apsis passages before this time since the start are ignored
+
+# altitude, speed and periapsis relative to the event body, periapsis is the
+# altitude of the osculating conic (negative: it goes through the body);
+# x y vx vy in the frame of the engine
+EventRecord = namedtuple('EventRecord', 'name case t altitude speed periapsis x y vx vy')
+
+BODY_MU = {EARTH: G*EARTH_MASS, MOON: G*MOON_MASS}
+
+#
+# Event functions, one value per spacecraft
+#
+
+def periapsis_radius(r, v, mu):
+    """Periapsis radius of the osculating two-body conic of relative state (r, v)."""
+    h = r[0]*v[1] - r[1]*v[0]
+    energy = (v[0]**2 + v[1]**2)/2 - mu/np.hypot(*r)
+    e = np.sqrt(max(0.0, 1 + 2*energy*h**2/mu**2))
+    return h**2 / (mu*(1 + e))
+
+
+def _relative(pos, vel, body):
+    return pos[SPACECRAFT:] - pos[body], vel[SPACECRAFT:] - vel[body]
+
+
+def _distance(pos, body):
+    d = pos[SPACECRAFT:] - pos[body]
+    return np.hypot(d[:, 0], d[:, 1])
+
+
+def _radial_velocity(pos, vel, body):
+    # r.v, negative while approaching the body, positive after the passage
+    r, v = _relative(pos, vel, body)
+    return np.einsum('ij,ij->i', r, v)
+
+
+def moon_impact(pos, vel):
+    return _distance(pos, MOON) - MOON_RADIUS
+
+
+def entry_interface(pos, vel):
+    return _distance(pos, EARTH) - (EARTH_RADIUS + ENTRY_INTERFACE_ALTITUDE)
+
+
+def perilune(pos, vel):
+    return _radial_velocity(pos, vel, MOON)
+
+
+def perigee(pos, vel):
+    return _radial_velocity(pos, vel, EARTH)
+
+
+def escape(pos, vel):
+    return _distance(pos, EARTH) - ESCAPE_RADIUS
+
+
+class Event(object):
+    """
+    fun(pos, vel) -> (N,) values for the N spacecraft
+    direction: -1 for a crossing from above zero, +1 from below
+    body: EARTH or MOON, for the altitude and speed of the records
+    min_time: crossings before this time since the start are ignored
+    """
+    def __init__(self, name, fun, direction, body, radius, terminal, min_time=0.0):
+        self.name = name
+        self.fun = fun
+        self.direction = direction
+        self.body = body
+        self.radius = radius
+        self.terminal = terminal
+        self.min_time = min_time
+
+    def __call__(self, pos, vel):
+        return self.fun(pos, vel)
+
+    def crossed(self, g0, g1):
+        if self.direction < 0:
+            return (g0 > 0) & (g1 <= 0)
+        return (g0 < 0) & (g1 >= 0)
+
+
+# name: (fun, direction, body, radius, terminal, min_time)
+EVENTS = {
+    'moon_impact': (moon_impact, -1, MOON, MOON_RADIUS, True, 0.0),
+    'entry_interface': (entry_interface, -1, EARTH, EARTH_RADIUS, True, 0.0),
+    'perilune': (perilune, +1, MOON, MOON_RADIUS, False, APSIS_MIN_TIME),
+    'perigee': (perigee, +1, EARTH, EARTH_RADIUS, False, APSIS_MIN_TIME),
+    'escape': (escape, +1, EARTH, EARTH_RADIUS, True, 0.0),
+}
+
+
+def make_events(names, stop=True):
+    """stop=False records the terminal events without stopping."""
+    events = []
+    for name in names:
+        if name not in EVENTS:
+            raise ValueError('Unknown event "%s", expected one of %s' % (name, ', '.join(EVENTS)))
+        fun, direction, body, radius, terminal, min_time = EVENTS[name]
+        events.append(Event(name, fun, direction, body, radius, terminal and stop, min_time))
+    return events
+
+
+def find_root(fun, a, b, fa, fb, xtol=ROOT_XTOL, max_iter=100):
+    """Illinois regula falsi on [a, b], fa and fb of opposite signs."""
+    if fa == 0:
+        return a
+    side = 0
+    c = a
+    for _ in range(max_iter):
+        c_prev = c
+        c = (a*fb - b*fa) / (fb - fa)
+        fc = fun(c)
+        if fc == 0 or abs(c - c_prev) < xtol:
+            break
+        if fc*fb > 0:
+            b, fb = c, fc
+            if side == -1:
+                fa /= 2
+            side = -1
+        else:
+            a, fa = c, fc
+            if side == +1:
+                fb /= 2
+            side = +1
+    return c
+
+
+class EventDetector(object):
+    """
+    Tracks the events of the N spacecraft of an engine.
+
+    cases: case index of each spacecraft row still in the engine
+    records: EventRecord list, in detection order
+    frame_angular_speed: rotation of the engine frame, the record speed and
+    periapsis use the inertial relative velocity
+    """
+    def __init__(self, events, n_spacecraft):
+        self.events = events
+        self.cases = np.arange(n_spacecraft)
+        self.records = []
+        self.g = None
+        self.frame_angular_speed = 0.0
+        self.t_start = 0.0
+
+    def start(self, pos, vel, frame_angular_speed=0.0, t_start=0.0):
+        self.g = [event(pos, vel) for event in self.events]
+        self.frame_angular_speed = frame_angular_speed
+        self.t_start = t_start
+
+    def check(self, t0, t1, pos, vel, locate):
+        """
+        After an interval [t0, t1] ending on state (pos, vel).
+        locate(event, row, t0, t1) -> (t, pos, vel) on the crossing, with
+        pos, vel the (3, 2) Earth, Moon, spacecraft rows.
+
+        Returns {row: event time} of the spacecraft to stop, the caller
+        removes them and calls remove().
+        """
+        hits = []
+        for (k, event) in enumerate(self.events):
+            g = event(pos, vel)
+            for row in np.flatnonzero(event.crossed(self.g[k], g)):
+                t, p, v = locate(event, row, t0, t1)
+                if t - self.t_start >= event.min_time:
+                    hits.append((t, event, row, p, v))
+            self.g[k] = g
+
+        stopped = {}
+        for (t, event, row, p, v) in sorted(hits, key=lambda hit: hit[0]):
+            if row in stopped:
+                continue
+            r = p[SPACECRAFT] - p[event.body]
+            # relative velocity is frame dependent: dv + w x r
+            dv = v[SPACECRAFT] - v[event.body] + self.frame_angular_speed*np.array([-r[1], r[0]])
+            self.records.append(EventRecord(
+                event.name, int(self.cases[row]), t,
+                np.hypot(*r) - event.radius, np.hypot(*dv),
+                periapsis_radius(r, dv, BODY_MU[event.body]) - event.radius,
+                p[SPACECRAFT][0], p[SPACECRAFT][1], v[SPACECRAFT][0], v[SPACECRAFT][1],
+            ))
+            if event.terminal:
+                stopped[row] = t
+
+        return stopped
+
+    def euler_locator(self, pos0, vel0, engine, sim_dt):
+        """
+        locate() for the fixed step engines, from the state (pos0, vel0) at
+        the start of the interval: the spacecraft is stepped again alone up
+        to the step of the crossing, the root is found on the linear
+        interpolation inside it.
+        """
+        def locate(event, row, t0, t1):
+            rows = [EARTH, MOON, SPACECRAFT+row]
+            probe = engine.probe(rows, pos0, vel0)
+            t_a = t0
+            pa, va = probe.pos.copy(), probe.vel.copy()
+            ga = event(pa, va)[0]
+
+            for _ in range(int(round((t1 - t0) / sim_dt))):
+                probe.advance(1, sim_dt)
+                gb = event(probe.pos, probe.vel)[0]
+                if event.crossed(ga, gb):
+                    break
+                t_a += sim_dt
+                pa, va = probe.pos.copy(), probe.vel.copy()
+                ga = gb
+            pb, vb = probe.pos, probe.vel
+
+            def state(t):
+                f = (t - t_a) / sim_dt
+                return pa + f*(pb - pa), va + f*(vb - va)
+
+            t = find_root(lambda t: event(*state(t))[0], t_a, t_a + sim_dt, ga, gb)
+            return (t,) + state(t)
+
+        return locate
+
+    def dense_locator(self, dense, n_pos):
+        """locate() for the rk45 steps, on the dense output of the step."""
+        def state(t):
+            y = dense(np.array([t]))[0]
+            return y[:n_pos].reshape(-1, 2), y[n_pos:].reshape(-1, 2)
+
+        def locate(event, row, t0, t1):
+            fun = lambda t: event(*state(t))[row]
+            t = find_root(fun, t0, t1, fun(t0), fun(t1))
+            p, v = state(t)
+            rows = [EARTH, MOON, SPACECRAFT+row]
+            return t, p[rows], v[rows]
+
+        return locate
+
+    def remove(self, rows):
+        keep = np.ones(len(self.cases), dtype=bool)
+        keep[rows] = False
+        self.cases = self.cases[keep]
+        self.g = [g[keep] for g in self.g]
+
+
+def write_events(filename, records, cases):
+    """One line per record; cases: (angle, dv) of each case index."""
+    with open(filename, 'w') as f:
+        f.write('angle dv event t altitude speed periapsis x y vx vy\n')
+        for r in records:
+            angle, dv = cases[r.case]
+            f.write('{:.3f} {:.3f} {} {:.3f} {:.0f} {:.3f} {:.0f} {:.0f} {:.0f} {:.3f} {:.3f}\n'.format(
+                angle, dv, r.name, r.t, r.altitude, r.speed, r.periapsis, r.x, r.y, r.vx, r.vy,
+            ))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''
+Free-return targeting: finds the injection angle and ΔV that give a wanted
+perilune altitude and return perigee altitude, by differential correction
+(Newton iterations with a finite difference Jacobian) on the rk45 runs and
+their events, on the array or cr3bp engine.
+
+The nominal case and its two perturbed cases of an iteration are
+propagated together as one batch.
+'''
+
+import numpy as np
+
+from sim_adaptive import (
+    RTOL,
+    run_rk45,
+)
+from sim_common import (
+    SIM_DURATION,
+    make_bodies,
+    make_engine,
+)
+from sim_events import (
+    EventDetector,
+    make_events,
+)
+
+TARGET_EVENTS = ('moon_impact', 'entry_interface', 'perilune', 'perigee')
+
+# finite difference steps
+D_ANGLE = 0.01  # deg
+D_DV = 0.01  # m/s
+
+# largest correction of one iteration
+MAX_D_ANGLE = 5.0  # deg
+MAX_D_DV = 20.0  # m/s
+
+TOLERANCE = 1000  # m, on both altitudes
+MAX_ITERATIONS = 20
+MAX_HALVINGS = 8
+
+
+class TargetingError(Exception):
+    pass
+
+
+def free_return_altitudes(records, case):
+    """
+    (perilune altitude, return perigee altitude) of a case from its event
+    records, from the osculating periapsis when the spacecraft hits the
+    Moon or reaches the entry interface before the passage.
+    """
+    records = [r for r in records if r.case == case]
+
+    lunar = [r for r in records if r.name in ('perilune', 'moon_impact')]
+    if not lunar:
+        raise TargetingError('case %d: no perilune passage' % case)
+    perilune = lunar[0]
+    perilune_alt = perilune.altitude if perilune.name == 'perilune' else perilune.periapsis
+
+    earth = [r for r in records if r.name in ('perigee', 'entry_interface') and r.t > perilune.t]
+    if perilune.name == 'moon_impact' or not earth:
+        raise TargetingError('case %d: no return to the Earth' % case)
+    perigee = earth[0]
+    perigee_alt = perigee.altitude if perigee.name == 'perigee' else perigee.periapsis
+
+    return perilune_alt, perigee_alt
+
+
+def evaluate(cases, sim_duration=SIM_DURATION, rtol=RTOL, engine='array'):
+    """
+    (perilune, perigee) altitudes of the (angle, dv) cases, one rk45 batch
+    on the engine ('array' or 'cr3bp', sim_common.make_engine).
+    """
+    bodies = [make_bodies(angle, dv) for (angle, dv) in cases]
+    earth, moon, _spacecraft = bodies[0]
+    engine = make_engine(engine, earth, moon, *[sc for (_e, _m, sc) in bodies])
+    detector = EventDetector(make_events(TARGET_EVENTS), len(cases))
+
+    run_rk45(engine, sim_duration, rtol, detector=detector)
+    return np.array([free_return_altitudes(detector.records, i) for i in range(len(cases))])
+
+
+def _cases(x):
+    return [tuple(x), (x[0]+D_ANGLE, x[1]), (x[0], x[1]+D_DV)]
+
+
+def target_free_return(perilune_alt, perigee_alt, angle, dv, tolerance=TOLERANCE,
+                       max_iterations=MAX_ITERATIONS, sim_duration=SIM_DURATION, rtol=RTOL, engine='array',
+                       verbose=True):
+    """
+    Newton iterations from the (angle, dv) guess, which has to be a free
+    return already, with rk45 runs of tolerance rtol on the engine. A correction that leads to a trajectory without
+    perilune or return is halved until it does not.
+
+    Returns (angle, dv, altitudes, iterations, runs).
+    """
+    target = np.array([perilune_alt, perigee_alt], dtype=np.float64)
+    x = np.array([angle, dv], dtype=np.float64)
+    altitudes = evaluate(_cases(x), sim_duration, rtol, engine)
+    runs = 3
+
+    for iteration in range(1, max_iterations+1):
+        residual = altitudes[0] - target
+
+        if verbose:
+            print("iteration %2d: angle %.5f dv %.4f -> perilune %.0f m, perigee %.0f m" % (
+                iteration, x[0], x[1], altitudes[0][0], altitudes[0][1]))
+
+        if np.all(np.abs(residual) < tolerance):
+            return x[0], x[1], altitudes[0], iteration, runs
+
+        jacobian = np.column_stack(((altitudes[1] - altitudes[0]) / D_ANGLE, (altitudes[2] - altitudes[0]) / D_DV))
+        try:
+            dx = -np.linalg.solve(jacobian, residual)
+        except np.linalg.LinAlgError:
+            raise TargetingError('singular Jacobian at angle %.5f dv %.4f' % tuple(x))
+
+        # damp the step to stay where the linearisation holds
+        dx /= max(1.0, abs(dx[0]) / MAX_D_ANGLE, abs(dx[1]) / MAX_D_DV)
+
+        for _ in range(MAX_HALVINGS):
+            runs += 3
+            try:
+                altitudes = evaluate(_cases(x + dx), sim_duration, rtol, engine)
+                break
+            except TargetingError:
+                dx /= 2
+        else:
+            raise TargetingError('no free return along the correction from angle %.5f dv %.4f' % tuple(x))
+        x += dx
+
+    raise TargetingError('no convergence in %d iterations' % max_iterations)
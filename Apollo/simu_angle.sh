@@ -2,13 +2,5 @@
 
 #set -x
 
-#counter=-123.7
-
-for counter in $(seq -131.7 2 -123.7)
-do
-    new_counter=`echo ${counter/,/.}`
-    echo "angle: "$new_counter
-    echo  "python ./sim-free-return.py $new_counter 3150 10"
-    python ./sim-free-return.py $new_counter 3150 10
-done
-
+# one process, all the angles propagated together (see sim-sweep.py)
+python ./sim-sweep.py --angle-range -131.7 -123.7 2 --dv 3150 --sim-step-per-sec 10 --outdir angle
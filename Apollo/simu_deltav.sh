@@ -2,13 +2,5 @@
 
 #set -x
 
-#counter=-123.7
-
-for counter in $(seq 3145 1 3155)
-do
-    #new_counter=`echo ${counter/,/.}`
-    echo "dv: "$counter
-    echo  "python ./sim-free-return.py -110 counter 10"
-    python ./sim-free-return.py -123.7 $counter 10
-done
-
+# one process, all the ΔV propagated together (see sim-sweep.py)
+python ./sim-sweep.py --angle -123.7 --dv-range 3145 3155 1 --sim-step-per-sec 10 --outdir deltav
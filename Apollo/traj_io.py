@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+Binary trajectory files (.traj): a one-line JSON header with the columns,
+the row count and the run parameters, padded to 64 bytes, then the samples
+as little-endian float64 rows. read_traj memory-maps the rows, so loading
+a trajectory costs the header parse only.
+'''
+
+import json
+
+import numpy as np
+
+MAGIC = b'TRAJ1'
+ALIGN = 64
+DTYPE = np.dtype('<f8')
+
+
+def write_traj(filename, samples, columns, params=None):
+    """samples: (rows, len(columns)) array; params: JSON-able run parameters."""
+    samples = np.ascontiguousarray(samples, dtype=DTYPE)
+    assert samples.ndim == 2 and samples.shape[1] == len(columns), "samples do not match the columns"
+
+    header = json.dumps({
+        'columns': list(columns),
+        'rows': samples.shape[0],
+        'params': params or {},
+    }).encode('utf-8')
+    header = MAGIC + b' ' + header
+    header += b' ' * (-(len(header) + 1) % ALIGN) + b'\n'
+
+    with open(filename, 'wb') as f:
+        f.write(header)
+        samples.tofile(f)
+
+
+def read_traj_header(filename):
+    """Returns (header dict, offset of the samples)."""
+    with open(filename, 'rb') as f:
+        line = f.readline()
+    if not line.startswith(MAGIC + b' '):
+        raise ValueError('%s is not a trajectory file' % filename)
+    return json.loads(line[len(MAGIC)+1:].decode('utf-8')), len(line)
+
+
+def read_traj(filename):
+    """Returns (samples, header): samples is a read-only memory map."""
+    header, offset = read_traj_header(filename)
+    shape = (header['rows'], len(header['columns']))
+    if not header['rows']:
+        return np.empty(shape, dtype=DTYPE), header
+    samples = np.memmap(filename, dtype=DTYPE, mode='r', offset=offset, shape=shape)
+    return samples, header
@@ -1,7 +1,22 @@
 import datetime
 
+import numpy as np
+
+from math_utility import hermite
+
+DAY_SECONDS = 86400.0
+UNIX_EPOCH_JD = 2440587.5
+# times closer than this (days) are the same sample
+SAME_TIME = 1e-6
+
 
 class ArtemisObject(object):
+    # one state vector; the series are held by StateVectorTable, this is
+    # the row view of StateVectorTable.row()
+    __slots__ = ('artemis_date',
+                 'pos_x', 'pos_y', 'pos_z',
+                 'speed_x', 'speed_y', 'speed_z',
+                 'att_x', 'att_y', 'att_z')
 
     def setTimeStamp(self, timestamp):
         self.artemis_date = timestamp
@@ -36,3 +51,137 @@ class ArtemisObject(object):
               f' pos: [{self.pos_x}, {self.pos_y}, {self.pos_z}]'
               f' speed: [{self.speed_x}, {self.speed_y}, {self.speed_z}]'
               f' attitude: [{self.att_x}, {self.att_y}, {self.att_z}]')
+
+
+class StateVectorTable(object):
+    # state vectors as columns, sorted by time:
+    #   time  (N,)   datetime64 (Horizons: Calendar Date (TDB))
+    #   jd    (N,)   Julian day (Horizons: JDTDB), None if not known
+    #   pos   (N, 3) x, y, z (km)
+    #   vel   (N, 3) vx, vy, vz (km/s)
+    #   att   (N, 3) attitude, None if not known
+    # time can be a timedelta64 too (mission elapsed time)
+
+    def __init__(self, time, pos, vel, jd=None, att=None):
+        self.time = np.asarray(time)
+        self.pos = np.asarray(pos, dtype=np.float64).reshape(-1, 3)
+        self.vel = np.asarray(vel, dtype=np.float64).reshape(-1, 3)
+        self.jd = None if jd is None else np.asarray(jd, dtype=np.float64)
+        self.att = None if att is None else np.asarray(att, dtype=np.float64).reshape(-1, 3)
+
+    @classmethod
+    def from_dataframe(cls, df, time_column='Calendar Date'):
+        # one row per time, the last one of duplicates, as the dict of
+        # ArtemisObject keyed by time did
+        df = df.drop_duplicates(subset=time_column, keep='last').sort_values(time_column, kind='stable')
+        jd = df['JDTDB'].to_numpy(dtype=np.float64) if 'JDTDB' in df else None
+        return cls(df[time_column].to_numpy(),
+                   df[['X', 'Y', 'Z']].to_numpy(dtype=np.float64),
+                   df[['VX', 'VY', 'VZ']].to_numpy(dtype=np.float64),
+                   jd)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        # a slice or a mask of the rows is a table too
+        return StateVectorTable(self.time[index], self.pos[index], self.vel[index],
+                                None if self.jd is None else self.jd[index],
+                                None if self.att is None else self.att[index])
+
+    def append(self, other):
+        # the table of the rows of both, still one row per time: a new row
+        # of an existing time replaces it
+        table = StateVectorTable(np.concatenate((self.time, other.time)),
+                                 np.concatenate((self.pos, other.pos)),
+                                 np.concatenate((self.vel, other.vel)),
+                                 join_optional(self.jd, other.jd),
+                                 join_optional(self.att, other.att))
+        if len(self) and len(other) and other.time[0] <= self.time[-1]:
+            order = np.argsort(table.time, kind='stable')
+            time = table.time[order]
+            table = table[order[np.append(time[1:] != time[:-1], True)]]
+        return table
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def row(self, i):
+        artemis_nav_obj = ArtemisObject()
+        artemis_nav_obj.setTimeStamp(to_python_time(self.time[i]))
+        artemis_nav_obj.setPos(tuple(self.pos[i].tolist()))
+        artemis_nav_obj.setSpeed(tuple(self.vel[i].tolist()))
+        if self.att is not None:
+            artemis_nav_obj.setAttitude(tuple(self.att[i].tolist()))
+        return artemis_nav_obj
+
+    def axis(self):
+        # numeric time axis (days): JDTDB, else the Julian day of a datetime
+        # time (the Horizons calendar date is TDB too), else the days of a
+        # mission elapsed time
+        if self.jd is not None:
+            return self.jd
+        if np.issubdtype(self.time.dtype, np.datetime64):
+            return (self.time - np.datetime64(0, 's')) / np.timedelta64(1, 'D') + UNIX_EPOCH_JD
+        return self.time / np.timedelta64(1, 'D')
+
+    def state_at(self, axis, cubic=True):
+        # (pos, vel) (N, 3) at the times axis (days): the samples at the same
+        # time, else interpolated between the two around, the position by
+        # cubic Hermite on the velocities (km/s) if cubic, else linearly; nan
+        # outside the table
+        own = self.axis()
+        axis = np.asarray(axis, dtype=np.float64)
+        j = np.clip(np.searchsorted(own, axis), min(1, len(own) - 1), len(own) - 1)
+        i = np.maximum(j - 1, 0)
+        inside = (axis >= own[0] - SAME_TIME) & (axis <= own[-1] + SAME_TIME)
+
+        dt = own[j] - own[i]
+        f = np.clip((axis - own[i]) / np.where(dt > 0, dt, 1), 0, 1)
+        # snap to the sample at the same time
+        f[np.abs(axis - own[i]) <= SAME_TIME] = 0
+        f[np.abs(axis - own[j]) <= SAME_TIME] = 1
+
+        vel = self.vel[i] + f[:, None] * (self.vel[j] - self.vel[i])
+        if cubic:
+            pos = hermite(self.pos[i], self.vel[i], self.pos[j], self.vel[j], dt * DAY_SECONDS, f)
+        else:
+            pos = self.pos[i] + f[:, None] * (self.pos[j] - self.pos[i])
+        exact = f == 0
+        pos[exact] = self.pos[i[exact]]
+        vel[exact] = self.vel[i[exact]]
+        exact = f == 1
+        pos[exact] = self.pos[j[exact]]
+        vel[exact] = self.vel[j[exact]]
+        pos[~inside] = np.nan
+        vel[~inside] = np.nan
+        return pos, vel
+
+    def day_starts(self):
+        # index of the first state vector of every calendar day
+        days = self.time.astype('datetime64[D]')
+        return np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+
+
+def align(table, reference, cubic=True):
+    # the rows of table within the time span of reference, and the
+    # (pos, vel) of reference at their times (StateVectorTable.state_at)
+    if len(table) == 0 or len(reference) == 0:
+        return table[:0], np.empty((0, 3)), np.empty((0, 3))
+    pos, vel = reference.state_at(table.axis(), cubic)
+    inside = ~np.isnan(pos[:, 0])
+    return table[inside], pos[inside], vel[inside]
+
+
+def join_optional(a, b):
+    return None if a is None or b is None else np.concatenate((a, b))
+
+
+def to_python_time(value):
+    # datetime64 -> datetime.datetime, timedelta64 -> datetime.timedelta
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[us]').item()
+    if isinstance(value, np.timedelta64):
+        return value.astype('timedelta64[us]').item()
+    return value
@@ -1,6 +1,27 @@
+import datetime
+import re
 import sqlite3
 from sqlite3 import Error
 
+import numpy as np
+
+import artemis_nav
+
+# typed copy of the state_vector table: mission elapsed time in seconds
+# (the primary key, so the time index of the table) and real columns
+NAV_STATE_COLUMNS = ('met', 'x', 'y', 'z', 'vx', 'vy', 'vz', 'att_x', 'att_y', 'att_z')
+NAV_STATE_SCHEMA = ("CREATE TABLE IF NOT EXISTS nav_state("
+                    "met INTEGER PRIMARY KEY,"
+                    "x REAL NOT NULL, y REAL NOT NULL, z REAL NOT NULL,"
+                    "vx REAL NOT NULL, vy REAL NOT NULL, vz REAL NOT NULL,"
+                    "att_x REAL, att_y REAL, att_z REAL);")
+# high-water mark of the ingestion: last state_vector rowid copied
+NAV_INGEST_SCHEMA = ("CREATE TABLE IF NOT EXISTS nav_ingest("
+                     "source TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL);")
+
+# "3 days 11  hrs 49  min"
+MET_PATTERN = re.compile(r'^\s*(\d+)\s*days?\s*(\d+)\s*hrs?\s*(\d+)\s*min\s*$')
+
 
 def create_connection(db_file):
     conn = None
@@ -27,41 +48,98 @@ def parse_nav_field(artemis_nav_field, nav_object):
     return artemis_nav_field
 
 
-def db_get_nav_point(conn):
-    nav_point_dict = {}
+def parse_mission_time(artemis_timestamp):
+    match = MET_PATTERN.match(artemis_timestamp)
+    if match is None:
+        raise ValueError(f'Unknown mission elapsed time: {artemis_timestamp!r}')
+    day, hour, minute = (int(token) for token in match.groups())
+    return ((day * 24 + hour) * 60 + minute) * 60
+
 
+def parse_state_vector_row(row):
+    met = parse_mission_time(row[0])
+    pos = [float(token) for token in parse_nav_field(row[1], 'P')[:3]]
+    speed = [float(token) for token in parse_nav_field(row[2], 'V')[:3]]
+    attitude = [float(token) for token in parse_nav_field(row[3], 'O')[:3]]
+    return [met] + pos + speed + attitude
+
+
+def db_ingest(conn):
+    # copies to nav_state the state_vector rows added since the last call
+    # (rowid above the high-water mark), returns their number; of two rows
+    # of the same time the last one is kept
+    with conn:
+        conn.execute(NAV_STATE_SCHEMA)
+        conn.execute(NAV_INGEST_SCHEMA)
     cur = conn.cursor()
-    cur.execute("SELECT timestamp, position, speed, attitude FROM state_vector order by timestamp;")
-    rows = cur.fetchall()
-
-    for row in rows:
-        artemis_timestamp = row[0]
-        artemis_timestamp = artemis_timestamp.replace(" ", "")
-        artemis_timestamp = artemis_timestamp.replace("days", ":")
-        artemis_timestamp = artemis_timestamp.replace("hrs", ":")
-        artemis_timestamp = artemis_timestamp.replace("min", ":")
-        date_tokens = artemis_timestamp.split(':')
-        day = int(date_tokens[0])
-        hour = int(date_tokens[1])
-        minute = int(date_tokens[2])
-        sec = 0
-
-        artemis_nav_obj = artemis_nav.ArtemisObject()
-        artemis_nav_obj.setTimeStamp(datetime.timedelta(days=day, hours=hour, minutes=minute, seconds=sec))
-
-        pos_tokens = parse_nav_field(row[1], 'P')
-        tuple_pos = (float(pos_tokens[0]), float(pos_tokens[1]), float(pos_tokens[2]))
-        artemis_nav_obj.setPos(tuple_pos)
-
-        speed_tokens = parse_nav_field(row[2], 'V')
-        tuple_speed = (float(speed_tokens[0]), float(speed_tokens[1]), float(speed_tokens[2]))
-        artemis_nav_obj.setSpeed(tuple_speed)
-
-        attitude_tokens = parse_nav_field(row[3], 'O')
-        tuple_attitude = (float(attitude_tokens[0]), float(attitude_tokens[1]), float(attitude_tokens[2]))
-        artemis_nav_obj.setAttitude(tuple_attitude)
-
-        nav_point_dict[artemis_nav_obj.getArtemisDate()] = artemis_nav_obj
-
-    nav_point_sort = dict(sorted(nav_point_dict.items()))
-    return nav_point_sort
+    cur.execute("SELECT last_rowid FROM nav_ingest WHERE source = 'state_vector';")
+    row = cur.fetchone()
+    last_rowid = 0 if row is None else row[0]
+    cur.execute("SELECT MAX(rowid) FROM state_vector;")
+    max_rowid = cur.fetchone()[0] or 0
+    if max_rowid < last_rowid:
+        # state_vector rewritten
+        return db_migrate(conn)
+    if max_rowid == last_rowid:
+        return 0
+
+    cur.execute("SELECT timestamp, position, speed, attitude FROM state_vector "
+                "WHERE rowid > ? AND rowid <= ? ORDER BY rowid;", (last_rowid, max_rowid))
+    rows = [parse_state_vector_row(row) for row in cur.fetchall()]
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO nav_state({', '.join(NAV_STATE_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(NAV_STATE_COLUMNS))});", rows)
+        conn.execute("INSERT OR REPLACE INTO nav_ingest(source, last_rowid) VALUES ('state_vector', ?);",
+                     (max_rowid,))
+    return len(rows)
+
+
+def db_migrate(conn):
+    # rebuilds nav_state from all the rows of state_vector
+    with conn:
+        conn.execute(NAV_STATE_SCHEMA)
+        conn.execute(NAV_INGEST_SCHEMA)
+        conn.execute("DELETE FROM nav_state;")
+        conn.execute("DELETE FROM nav_ingest WHERE source = 'state_vector';")
+    return db_ingest(conn)
+
+
+def to_seconds(met):
+    if isinstance(met, datetime.timedelta):
+        return int(met.total_seconds())
+    if isinstance(met, np.timedelta64):
+        return int(met // np.timedelta64(1, 's'))
+    return int(met)
+
+
+def db_load_state_vector(conn, start=None, end=None, after=None):
+    # StateVectorTable of the typed state vectors with start <= time <= end
+    # and time > after (datetime.timedelta or seconds, None: unbounded), the
+    # time a timedelta64[s]; the new state_vector rows are ingested first,
+    # the range is an indexed query
+    db_ingest(conn)
+
+    where = []
+    params = []
+    if after is not None:
+        where.append("met > ?")
+        params.append(to_seconds(after))
+    if start is not None:
+        where.append("met >= ?")
+        params.append(to_seconds(start))
+    if end is not None:
+        where.append("met <= ?")
+        params.append(to_seconds(end))
+    query = f"SELECT {', '.join(NAV_STATE_COLUMNS)} FROM nav_state"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    cur = conn.cursor()
+    cur.execute(query + " ORDER BY met;", params)
+    data = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, len(NAV_STATE_COLUMNS))
+
+    return artemis_nav.StateVectorTable(data[:, 0].astype(np.int64).astype('timedelta64[s]'),
+                                        data[:, 1:4], data[:, 4:7], att=data[:, 7:10])
+
+
+def db_get_nav_point(conn, start=None, end=None):
+    return db_load_state_vector(conn, start, end)
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import artemis_nav
+
+# Horizons vector table exported as CSV (see README.md for the symbols);
+# every line ends with a comma, the empty last column is not read
+COLUMNS = ['JDTDB', 'Calendar Date (TDB)', 'X', 'Y', 'Z', 'VX', 'VY', 'VZ', 'LT', 'RG', 'RR']
+DTYPES = dict((column, np.float64) for column in COLUMNS if column != 'Calendar Date (TDB)')
+DTYPES['Calendar Date (TDB)'] = str
+DATE_FORMAT = 'A.D. %Y-%b-%d %H:%M:%S.%f'
+
+CACHE_SUFFIX = '.npz'
+
+
+def parse_horizons_rows(data, header=True):
+    # data: bytes of complete lines, the header line first if header
+    df = pd.read_csv(io.BytesIO(data), sep=',', header=0 if header else None,
+                     names=None if header else COLUMNS + [''], usecols=COLUMNS, dtype=DTYPES,
+                     skipinitialspace=True, engine='c')
+    df.rename(columns={"Calendar Date (TDB)": "Calendar Date"}, inplace=True)
+    df['Calendar Date'] = pd.to_datetime(df['Calendar Date'], format=DATE_FORMAT)
+    return df
+
+
+def read_horizons_csv(csv_file):
+    df, _ = read_horizons_tail(csv_file, 0)
+    return df
+
+
+def is_complete_row(line):
+    # a whole Horizons row: its len(COLUMNS) fields, each ended by a comma
+    line = line.rstrip(b'\r')
+    return line.endswith(b',') and line.count(b',') == len(COLUMNS)
+
+
+def read_horizons_tail(csv_file, offset, follow=False):
+    # the rows after byte offset (0: the whole file, with its header), and
+    # the offset after them; following a file being written, a last line
+    # without newline is held back until it is a complete row
+    with open(csv_file, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    if not follow or is_complete_row(data[end:]):
+        end = len(data)
+    if not data[:end].strip():
+        # no new row: no rows, of the same columns
+        return parse_horizons_rows((','.join(COLUMNS) + ',\n').encode()), offset
+    df = parse_horizons_rows(data[:end], header=offset == 0)
+    lines = sum(1 for line in data[:end].splitlines() if line.strip()) - (offset == 0)
+    if len(df) != lines:
+        raise ValueError(f'{csv_file}: {len(df)} rows parsed of {lines} lines after byte {offset}')
+    return df, offset + end
+
+
+def file_stamp(csv_file):
+    stat = os.stat(csv_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def file_hash(csv_file, size=None):
+    # SHA-1 of the first size bytes (None: all)
+    sha = hashlib.sha1()
+    with open(csv_file, 'rb') as f:
+        left = size
+        while left is None or left > 0:
+            block = f.read(1 << 20 if left is None else min(1 << 20, left))
+            if not block:
+                break
+            sha.update(block)
+            if left is not None:
+                left -= len(block)
+    return sha.hexdigest()
+
+
+def read_cache(cache_file, csv_file):
+    # (table, offset): the cached table of the first offset bytes of
+    # csv_file, if they did not change (same size and mtime, else same
+    # SHA-1); None if the cache is not of this file
+    if not os.path.exists(cache_file):
+        return None
+    with np.load(cache_file) as data:
+        offset = int(data['offset'])
+        if not np.array_equal(data['stamp'], file_stamp(csv_file)):
+            if os.path.getsize(csv_file) < offset or str(data['sha1']) != file_hash(csv_file, offset):
+                return None
+        table = artemis_nav.StateVectorTable(data['time'], data['pos'], data['vel'], data['jd'])
+    return table, offset
+
+
+def write_cache(cache_file, csv_file, table, offset):
+    tmp = cache_file + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, stamp=file_stamp(csv_file), offset=np.array(offset), sha1=np.array(file_hash(csv_file, offset)),
+                 time=table.time, jd=table.jd, pos=table.pos, vel=table.vel)
+    os.replace(tmp, cache_file)
+
+
+def load_state_vector(csv_file, use_cache=True):
+    # the StateVectorTable of a Horizons CSV, from <csv_file>.npz when up to
+    # date; when the file grew, only the lines appended since are parsed and
+    # the cache updated; else parsed and cached there
+    cache_file = csv_file + CACHE_SUFFIX
+    cached = None
+    if use_cache:
+        try:
+            cached = read_cache(cache_file, csv_file)
+        except (OSError, KeyError, ValueError) as e:
+            print(f'Ignoring cache {cache_file}: {e}')
+
+    if cached is None:
+        df, offset = read_horizons_tail(csv_file, 0, follow=True)
+        table = artemis_nav.StateVectorTable.from_dataframe(df)
+    else:
+        table, offset = cached
+        if os.path.getsize(csv_file) == offset:
+            return table
+        df, new_offset = read_horizons_tail(csv_file, offset, follow=True)
+        if new_offset == offset:
+            return table
+        table = table.append(artemis_nav.StateVectorTable.from_dataframe(df))
+        offset = new_offset
+
+    if use_cache:
+        try:
+            write_cache(cache_file, csv_file, table, offset)
+        except OSError as e:
+            print(f'Cannot write cache {cache_file}: {e}')
+    return table
@@ -1,14 +1,23 @@
-import math
+import numpy as np
 
-from scipy.spatial import distance
 
+def norms(vectors):
+    # norm of every row of an (N, 3) array
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
 
-def pythagoras(vector_a, vector_b):
-    dst = distance.euclidean(vector_a, vector_b)
-    return dst
 
+def distances(points_a, points_b):
+    # distance of every pair of rows of two (N, 3) arrays
+    return norms(np.asarray(points_a, dtype=np.float64) - np.asarray(points_b, dtype=np.float64))
 
-def norma(v):
-    (x, y, z) = v
-    module = (x * x) + (y * y) + (z * z)
-    return math.sqrt(module)
+
+def hermite(p0, v0, p1, v1, dt, f):
+    # cubic Hermite interpolation at the fractions f (N,) of the steps dt
+    # (N,) between the values p (N, 3) and derivatives v (N, 3) at their ends
+    f = f[:, None]
+    dt = dt[:, None]
+    f2 = f * f
+    f3 = f2 * f
+    return ((2 * f3 - 3 * f2 + 1) * p0 + (f3 - 2 * f2 + f) * dt * v0 +
+            (-2 * f3 + 3 * f2) * p1 + (f3 - f2) * dt * v1)
@@ -0,0 +1,161 @@
+'''
+Follow mode: polls the Artemis telemetry while it grows and keeps the
+navigation series and the derived ones up to date, parsing only the new rows:
+
+    python nav_follow.py data/artemis.db
+    python nav_follow.py data/artemis.barycenter.state_vector --interval 60
+    python nav_follow.py data/artemis.db --plot figure/Artemis_follow.png
+
+A .db source is the state_vector table of the sqlite database, ingested from
+its high-water mark (db_utility.db_ingest); any other file is a Horizons CSV
+export, read from the byte offset of its last complete row. Every poll
+appends the new state vectors and their range (distance from the coordinate
+center) and speed, in O(new rows).
+'''
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import artemis_nav
+import db_utility
+from horizons_utility import read_horizons_tail
+from math_utility import norms
+
+
+class SeriesBuffer(object):
+    # growing columns, of capacity doubled when full: appending k rows
+    # costs O(k) amortized; the columns are views of the filled rows
+
+    def __init__(self):
+        self.columns = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, **columns):
+        k = len(next(iter(columns.values())))
+        for name, values in columns.items():
+            values = np.asarray(values)
+            column = self.columns.get(name)
+            if column is None:
+                column = np.empty((max(k, 1024),) + values.shape[1:], dtype=values.dtype)
+            elif self.size + k > len(column):
+                grown = np.empty((max(2 * len(column), self.size + k),) + column.shape[1:], dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                column = grown
+            column[self.size:self.size + k] = values
+            self.columns[name] = column
+        self.size += k
+
+    def __getitem__(self, name):
+        return self.columns[name][:self.size]
+
+
+class NavFollower(object):
+    # state vectors of increasing time and their derived series:
+    #   range (N,)  distance from the coordinate center
+    #   speed (N,)  norm of the velocity
+
+    def __init__(self):
+        self.series = SeriesBuffer()
+        self.late = 0  # rows not after the last one, not appended
+
+    def last_time(self):
+        return self.series['time'][-1] if len(self.series) else None
+
+    def add(self, table):
+        if len(self.series) and len(table):
+            keep = table.time > self.last_time()
+            self.late += int(np.count_nonzero(~keep))
+            table = table[keep]
+        if len(table):
+            self.series.append(time=table.time, pos=table.pos, vel=table.vel,
+                               range=norms(table.pos), speed=norms(table.vel))
+        return len(table)
+
+    def table(self):
+        return artemis_nav.StateVectorTable(self.series['time'], self.series['pos'], self.series['vel'])
+
+
+class DatabaseSource(object):
+
+    def __init__(self, db_file):
+        self.conn = db_utility.create_connection(db_file)
+
+    def poll(self, after):
+        return db_utility.db_load_state_vector(self.conn, after=after)
+
+
+class HorizonsSource(object):
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.offset = 0
+
+    def poll(self, after):
+        try:
+            if os.path.getsize(self.csv_file) < self.offset:
+                # replaced by a shorter file: read it again from the start
+                self.offset = 0
+            df, self.offset = read_horizons_tail(self.csv_file, self.offset, follow=True)
+        except FileNotFoundError:
+            # not dropped yet, or being replaced
+            return None
+        return artemis_nav.StateVectorTable.from_dataframe(df)
+
+
+def open_source(filename):
+    if filename.endswith('.db'):
+        return DatabaseSource(filename)
+    return HorizonsSource(filename)
+
+
+def save_plot(follower, filename):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    time_axis = follower.series['time']
+    if np.issubdtype(time_axis.dtype, np.timedelta64):
+        time_axis = time_axis / np.timedelta64(1, 'D')
+    fig, (ax_range, ax_speed) = plt.subplots(2, 1, sharex=True, figsize=(15, 10))
+    ax_range.plot(time_axis, follower.series['range'])
+    ax_range.set_ylabel("Range (Km)")
+    ax_speed.plot(time_axis, follower.series['speed'])
+    ax_speed.set_ylabel("Speed")
+    for ax in (ax_range, ax_speed):
+        ax.grid(color='green', linestyle='--', linewidth=1)
+    fig.savefig(filename, dpi=150)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="artemis.db or a Horizons CSV export")
+    parser.add_argument('--interval', type=float, default=10.0, help="seconds between polls (default: %(default)s)")
+    parser.add_argument('--polls', type=int, help="stop after that many polls (default: never)")
+    parser.add_argument('--plot', help="range and speed figure, saved when new rows arrive")
+    args = parser.parse_args()
+
+    source = open_source(args.source)
+    follower = NavFollower()
+    polls = 0
+    while args.polls is None or polls < args.polls:
+        if polls:
+            time.sleep(args.interval)
+        polls += 1
+        table = source.poll(follower.last_time())
+        if table is None or not follower.add(table):
+            continue
+        print(f'{len(follower.series)} state vectors, last {follower.last_time()}: '
+              f'range {follower.series["range"][-1]:.0f} Km, speed {follower.series["speed"][-1]:.3f}')
+        if args.plot:
+            save_plot(follower, args.plot)
+
+
+if __name__ == '__main__':
+    main()
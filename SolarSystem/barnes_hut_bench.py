@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+'''
+Accuracy and cost of the Barnes-Hut accelerations against the direct
+summation, on Plummer star clusters (10 000 solar masses, 1 pc scale
+radius):
+
+    python barnes_hut_bench.py                          -> N 1000 10000, theta 0.3 0.5 0.7 1.0
+    python barnes_hut_bench.py --n 100000 --theta 0.5 0.7
+    python barnes_hut_bench.py --n 10000 --steps 20     -> also 20 leapfrog steps
+
+For every N and theta: tree build and walk times, the relative error of the
+accelerations (median, 99th percentile, max) and of the potentials against
+the direct summation on --samples random bodies, and the direct summation
+time of all the bodies extrapolated from those. --steps runs the leapfrog
+integrator on the tree engine for the energy error and the time per step.
+'''
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from barnes_hut import BarnesHutEngine, Octree, direct_accelerations
+from integrators import make_integrator
+from nbody import G
+
+SOLAR_MASS = 1.98892e30
+PARSEC = 3.0857e16
+
+CLUSTER_MASS = 1e4 * SOLAR_MASS
+CLUSTER_RADIUS = PARSEC
+SOFTENING = 0.01 * PARSEC
+
+
+def plummer_sphere(n, total_mass=CLUSTER_MASS, radius=CLUSTER_RADIUS, seed=None):
+    """
+    (mass, pos, vel) of n equal-mass bodies drawn from a Plummer sphere of
+    scale radius radius (Aarseth, Henon and Wielen 1974), at rest at the origin.
+    """
+    rng = np.random.default_rng(seed)
+
+    def directions(k):
+        z = rng.uniform(-1, 1, k)
+        phi = rng.uniform(0, 2*np.pi, k)
+        s = np.sqrt(1 - z*z)
+        return np.column_stack((s*np.cos(phi), s*np.sin(phi), z))
+
+    # radius from the cumulative mass, cut at 99.9% of it
+    r = radius / np.sqrt(rng.uniform(0, 0.999, n)**(-2/3) - 1)
+
+    # speed in units of the escape speed, from g(q) = q^2 (1 - q^2)^3.5
+    q = np.empty(n)
+    todo = np.arange(n)
+    while len(todo):
+        x = rng.uniform(0, 1, len(todo))
+        y = rng.uniform(0, 0.1, len(todo))
+        ok = y < x*x*(1 - x*x)**3.5
+        q[todo[ok]] = x[ok]
+        todo = todo[~ok]
+    v_escape = np.sqrt(2*G*total_mass) * (r*r + radius*radius)**(-1/4)
+
+    pos = r[:, None] * directions(n)
+    vel = (q*v_escape)[:, None] * directions(n)
+    pos -= pos.mean(axis=0)
+    vel -= vel.mean(axis=0)
+    return np.full(n, total_mass / n), pos, vel
+
+
+def accuracy(mass, pos, theta, softening, samples, rng):
+    t_start = time.perf_counter()
+    tree = Octree(pos, mass)
+    t_build = time.perf_counter() - t_start
+    acc, phi = tree.walk(theta, softening)
+    t_walk = time.perf_counter() - t_start - t_build
+
+    targets = rng.choice(len(pos), min(samples, len(pos)), replace=False)
+    t_start = time.perf_counter()
+    acc_ref, phi_ref = direct_accelerations(pos, mass, targets, softening)
+    t_direct = (time.perf_counter() - t_start) * len(pos) / len(targets)
+
+    error = np.linalg.norm(acc[targets] - acc_ref, axis=1) / np.linalg.norm(acc_ref, axis=1)
+    phi_error = np.abs(phi[targets] - phi_ref) / np.abs(phi_ref)
+    return {
+        'build_s': t_build,
+        'walk_s': t_walk,
+        'direct_s': t_direct,
+        'levels': len(tree.levels),
+        'acc_error_median': float(np.median(error)),
+        'acc_error_p99': float(np.percentile(error, 99)),
+        'acc_error_max': float(error.max()),
+        'phi_error_median': float(np.median(phi_error)),
+    }
+
+
+def integration(mass, pos, vel, theta, softening, steps):
+    """steps leapfrog steps of 1/100 of the crossing time of the cluster."""
+    engine = BarnesHutEngine(mass, pos, vel, theta=theta, softening=softening)
+    dt = np.sqrt(CLUSTER_RADIUS**3 / (G*np.sum(mass))) / 100
+    e0 = engine.energy()
+    stepper = make_integrator('leapfrog', engine)
+    t_start = time.perf_counter()
+    for _ in range(steps):
+        stepper.step(dt)
+    wall = time.perf_counter() - t_start
+    return {
+        'steps': steps,
+        'step_s': wall / steps,
+        'energy_error': abs((engine.energy() - e0) / e0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, nargs='+', default=[1000, 10000], help="bodies (default: %(default)s)")
+    parser.add_argument('--theta', type=float, nargs='+', default=[0.3, 0.5, 0.7, 1.0],
+                        help="opening angles (default: %(default)s)")
+    parser.add_argument('--softening', type=float, default=SOFTENING,
+                        help="Plummer softening, m (default: %(default)s, 0.01 pc)")
+    parser.add_argument('--samples', type=int, default=1000,
+                        help="bodies checked against the direct summation (default: %(default)s)")
+    parser.add_argument('--steps', type=int, default=0, help="leapfrog steps per case (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--report', help="JSON report")
+    args = parser.parse_args()
+
+    records = []
+    for n in args.n:
+        mass, pos, vel = plummer_sphere(n, seed=args.seed)
+        for theta in args.theta:
+            record = {'n': n, 'theta': theta, 'softening': args.softening}
+            record.update(accuracy(mass, pos, theta, args.softening, args.samples, np.random.default_rng(args.seed)))
+            line = "N %6d theta %.2f: build %6.3f s, walk %7.3f s (direct %8.2f s), acc error %.1e / %.1e / %.1e" % (
+                n, theta, record['build_s'], record['walk_s'], record['direct_s'],
+                record['acc_error_median'], record['acc_error_p99'], record['acc_error_max'])
+            if args.steps:
+                record.update(integration(mass, pos, vel, theta, args.softening, args.steps))
+                line += ", %.3f s/step, energy error %.1e" % (record['step_s'], record['energy_error'])
+            print(line)
+            records.append(record)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'numpy': np.__version__, 'cases': records},
+                      f, indent=1)
+        print("report: %s" % args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+#
+# Checkpoints of the solar-system simulator: the whole state of a loop()
+# run (bodies, step, running extremes, test particles, conservation samples,
+# orbital diagnostics, integrator state, position of the output and run
+# settings) as the binary arrays of one .npz.
+# A checkpoint is written to a temporary file, synced, then renamed over the
+# previous one: an interrupted write never leaves a corrupt checkpoint.
+#
+
+import json
+import os
+
+import numpy as np
+
+VERSION = 1
+REASONS = ('far', 'close', 'unbound')
+
+
+def save_checkpoint(filename, engine, step, monitor, config, output=None, diagnostics=None, stepper=None):
+    """
+    Writes the state of the run at the start of step (engine, the
+    integrators.ConservationMonitor) to filename. config: the settings of
+    the run (json), output: TrajectoryWriter.position(), diagnostics: the
+    diagnostics.OrbitalDiagnostics, if any, stepper: the integrator, its
+    own state if it has one (integrators.WisdomHolman.arrays).
+    """
+    arrays = {
+        'mass': engine.mass,
+        'pos': engine.pos,
+        'vel': engine.vel,
+        'dmin': engine.dmin,
+        'dmax': engine.dmax,
+        'vmin': engine.vmin,
+        'vmax': engine.vmax,
+        'monitor_samples': np.array(monitor.samples).reshape(-1, len(monitor.COLUMNS)),
+    }
+    if monitor.e0 is not None:
+        arrays['monitor_e0'] = np.array(monitor.e0)
+        arrays['monitor_l0'] = monitor.l0
+    particles = engine.particles
+    if particles is not None:
+        arrays.update({
+            'particle_pos': particles.pos,
+            'particle_vel': particles.vel,
+            'particle_ids': particles.ids,
+            'particle_dmin': particles.dmin,
+            'particle_dmax': particles.dmax,
+            # id, t (s), reason index
+            'particle_removed': np.array([(i, t, REASONS.index(reason)) for (i, t, reason) in particles.removed],
+                                         dtype=np.float64).reshape(-1, 3),
+        })
+    if diagnostics is not None:
+        arrays.update(diagnostics.arrays())
+    if hasattr(stepper, 'arrays'):
+        arrays.update(stepper.arrays())
+    header = {'version': VERSION, 'step': step, 'names': engine.names, 'config': config, 'output': output}
+    arrays['header'] = np.array(json.dumps(header))
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def load_checkpoint(filename):
+    """The checkpoint as a dict: the header entries (step, names, config, output) and the arrays."""
+    with np.load(filename) as data:
+        checkpoint = dict((key, data[key]) for key in data.files if key != 'header')
+        header = json.loads(str(data['header']))
+    if header['version'] != VERSION:
+        raise ValueError('%s: checkpoint version %s, expected %d' % (filename, header['version'], VERSION))
+    checkpoint.update(header)
+    return checkpoint
+
+
+def restore(checkpoint, engine, monitor):
+    """
+    Sets the extremes, the test particles and the conservation samples of
+    the engine and the monitor built on the checkpoint bodies.
+    """
+    for name in ('pos', 'vel', 'dmin', 'dmax', 'vmin', 'vmax'):
+        getattr(engine, name)[:] = checkpoint[name]
+
+    if 'particle_pos' in checkpoint:
+        particles = engine.add_particles(checkpoint['particle_pos'], checkpoint['particle_vel'])
+        particles.ids = checkpoint['particle_ids']
+        particles.dmin = checkpoint['particle_dmin'].copy()
+        particles.dmax = checkpoint['particle_dmax'].copy()
+        particles.removed = [(int(i), t, REASONS[int(r)]) for (i, t, r) in checkpoint['particle_removed']]
+
+    monitor.samples = [tuple(row) for row in checkpoint['monitor_samples']]
+    if 'monitor_e0' in checkpoint:
+        monitor.e0 = float(checkpoint['monitor_e0'])
+        monitor.l0 = checkpoint['monitor_l0']
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+#
+# Online orbital diagnostics of the solar-system simulator, updated at every
+# step of loop() on the engine arrays (all the bodies at once, relative to
+# body 0, the Sun): instead of the full time series, one compact record per
+# event:
+#
+#   perihelion, aphelion  the heliocentric radial velocity changes sign, at
+#                         a time interpolated in the step, the distance from
+#                         the cubic Hermite interpolation of r
+#   revolution            the heliocentric longitude (ecliptic x-y) swept
+#                         since the start reaches another multiple of 2π,
+#                         interpolated too; their intervals are the sidereal
+#                         periods
+#
+# with the osculating elements (orbits.state_to_elements) at the end of the
+# step, the time since the previous event of the same kind and the relative
+# energy error of the whole system.
+#
+# The events csv has one header row, as the conservation csv
+# (ConservationMonitor.write): '# ' and the COLUMNS, of units UNITS.
+#
+
+import numpy as np
+
+from nbody import G
+from orbits import state_to_elements
+
+AU = (149.6e6 * 1000)
+DAY = 24 * 3600
+
+EVENTS = ('perihelion', 'aphelion', 'revolution')
+COLUMNS = ('t', 'body', 'event', 'r', 'a', 'e', 'i', 'node', 'peri', 'period', 'energy_error')
+UNITS = ('day', '', '', 'au', 'au', '', 'deg', 'deg', 'deg', 'day', '')
+
+
+class OrbitalDiagnostics:
+    """
+    engine: the nbody.NBodyEngine of the run, monitor its
+    integrators.ConservationMonitor (energy reference)
+    events: rows (t (s), body, event index, r (m), a (m), e, i, node, peri
+    (rad), period (s, since the previous event of the kind, nan for the
+    first peri/aphelion), energy error)
+    """
+    def __init__(self, engine, monitor):
+        self.engine = engine
+        self.monitor = monitor
+        n = engine.n_bodies()
+        self.mu = G * (engine.mass[0] + engine.mass)
+        self.events = []
+        self.t = None
+        # per body, at the last update
+        self.radial = np.zeros(n)
+        self.r = np.zeros(n)
+        self.longitude = np.zeros(n)
+        # swept longitude since the start, from t0
+        self.t0 = None
+        self.swept = np.zeros(n)
+        # time of the last event of every kind
+        self.last = np.full((len(EVENTS), n), np.nan)
+
+    def heliocentric(self):
+        engine = self.engine
+        pos = engine.pos - engine.pos[0]
+        vel = engine.vel - engine.vel[0]
+        if engine.dim() == 2:
+            pos = np.column_stack((pos, np.zeros(len(pos))))
+            vel = np.column_stack((vel, np.zeros(len(vel))))
+        return pos, vel
+
+    def update(self, t):
+        """After the step ending at t (s)."""
+        pos, vel = self.heliocentric()
+        r = np.sqrt(np.einsum('ij,ij->i', pos, pos))
+        radial = np.einsum('ij,ij->i', pos, vel) / np.where(r > 0, r, 1)
+        longitude = np.arctan2(pos[:, 1], pos[:, 0])
+
+        if self.t is None:
+            self.t0 = t
+            self.last[2] = t
+        else:
+            dt = t - self.t
+            found = []
+            # radial velocity sign changes, but body 0
+            for (kind, crossing) in ((0, (self.radial < 0) & (radial >= 0)), (1, (self.radial > 0) & (radial <= 0))):
+                crossing[0] = False
+                for k in np.flatnonzero(crossing):
+                    f = self.radial[k] / (self.radial[k] - radial[k])
+                    found.append((k, kind, self.t + f*dt, hermite(self.r[k], self.radial[k], r[k], radial[k], dt, f)))
+
+            # longitude swept, the step is much shorter than a period
+            step_angle = np.mod(longitude - self.longitude + np.pi, 2*np.pi) - np.pi
+            swept = self.swept + step_angle
+            turns = np.floor(np.abs(swept) / (2*np.pi))
+            for k in np.flatnonzero(turns > np.floor(np.abs(self.swept) / (2*np.pi))):
+                if k == 0:
+                    continue
+                f = (turns[k]*2*np.pi - np.abs(self.swept[k])) / np.abs(step_angle[k])
+                found.append((k, 2, self.t + f*dt, self.r[k] + f*(r[k] - self.r[k])))
+            self.swept = swept
+
+            if found:
+                self.record(found, pos, vel)
+
+        self.t = t
+        self.radial = radial
+        self.r = r
+        self.longitude = longitude
+
+    def record(self, found, pos, vel):
+        bodies = np.array([k for (k, _kind, _t, _r) in found])
+        elements = state_to_elements(pos[bodies], vel[bodies], self.mu[bodies])
+        energy_error = np.nan
+        if self.monitor.e0 is not None:
+            energy_error = abs((self.engine.energy() - self.monitor.e0) / self.monitor.e0)
+        for (j, (k, kind, t, r)) in enumerate(found):
+            self.events.append((t, k, kind, r) + tuple(x[j] for x in elements) +
+                               (t - self.last[kind, k], energy_error))
+            self.last[kind, k] = t
+        self.events.sort(key=lambda event: event[0])
+
+    def periods(self):
+        """
+        Per body (N, 3): sidereal period from the mean angular speed since
+        the start, mean of the revolution intervals, and the Kepler period
+        of the current osculating a (s); nan for body 0.
+        """
+        n = self.engine.n_bodies()
+        periods = np.full((n, 3), np.nan)
+        if self.t is not None and self.t > self.t0:
+            with np.errstate(divide='ignore'):
+                periods[:, 0] = 2*np.pi * (self.t - self.t0) / np.abs(self.swept)
+        for k in range(n):
+            intervals = [e[9] for e in self.events if e[1] == k and e[2] == 2 and not np.isnan(e[9])]
+            if intervals:
+                periods[k, 1] = np.mean(intervals)
+        pos, vel = self.heliocentric()
+        a = state_to_elements(pos[1:], vel[1:], self.mu[1:])[0]
+        periods[1:, 2] = np.where(a > 0, 2*np.pi * np.sqrt(np.abs(a)**3 / self.mu[1:]), np.nan)
+        periods[0] = np.nan
+        return periods
+
+    def write(self, filename):
+        names = self.engine.names
+        with open(filename, 'w') as f:
+            f.write('# ' + ','.join(COLUMNS) + '\n')
+            for (t, k, kind, r, a, e, i, node, peri, period, energy_error) in self.events:
+                f.write('%.17g,%s,%s,%.17g,%.17g,%.17g,%.17g,%.17g,%.17g,%.17g,%.17g\n' % (
+                    t / DAY, names[int(k)], EVENTS[int(kind)], r / AU, a / AU, e,
+                    np.degrees(i), np.degrees(node), np.degrees(peri), period / DAY, energy_error))
+
+    def arrays(self):
+        """State for a checkpoint (checkpoint.save_checkpoint)."""
+        return {
+            'diagnostics_events': np.array(self.events, dtype=np.float64).reshape(-1, len(COLUMNS)),
+            'diagnostics_state': np.column_stack((self.radial, self.r, self.longitude, self.swept)),
+            'diagnostics_last': self.last,
+            'diagnostics_times': np.array([np.nan if self.t is None else self.t,
+                                           np.nan if self.t0 is None else self.t0]),
+        }
+
+    def restore(self, checkpoint):
+        if 'diagnostics_events' not in checkpoint:
+            return
+        self.events = [tuple(row) for row in checkpoint['diagnostics_events']]
+        self.radial, self.r, self.longitude, self.swept = (x.copy() for x in checkpoint['diagnostics_state'].T)
+        self.last = checkpoint['diagnostics_last'].copy()
+        t, t0 = checkpoint['diagnostics_times']
+        self.t = None if np.isnan(t) else float(t)
+        self.t0 = None if np.isnan(t0) else float(t0)
+
+
+def hermite(r0, v0, r1, v1, dt, f):
+    """Cubic Hermite interpolation at the fraction f of a step dt, from the values and derivatives at its ends."""
+    f2 = f*f
+    f3 = f2*f
+    return ((2*f3 - 3*f2 + 1)*r0 + (f3 - 2*f2 + f)*dt*v0 +
+            (-2*f3 + 3*f2)*r1 + (f3 - f2)*dt*v1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+'''
+Ensemble of solar-system simulations over start dates and parameter sets,
+run on a process pool:
+
+    python ensemble.py --epochs "1822-09-23" "1990-09-23" --days 4000
+    python ensemble.py --epochs "1990-09-23" --clones 20 --dv 1.0 --seed 7
+    python ensemble.py runs.json --jobs 4
+
+runs.json: a list of runs, each a dict of RUN_DEFAULTS keys overriding the
+command line ones, e.g. {"epoch": "1990-09-23", "masses": {"Jupiter": 1.01}}.
+--clones makes that many copies of every run with Gaussian position and
+velocity perturbations (--dr, --dv, not on the Sun) of seeds seed, seed+1...
+
+Every run writes to <outdir>/<name>/: params.json, planets.json (the
+Horizons vectors), run.log (its prints), trajectory.*,
+trajectory_conservation.csv and trajectory_events.csv. The D/V extremes of
+all the bodies of all the runs are gathered in <outdir>/summary.csv.
+
+Memory: a run streams its samples to disk and only its summary rows come
+back; every worker process is replaced after one run, so nothing builds up
+over a long ensemble.
+'''
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import traceback
+
+import numpy as np
+
+from barnes_hut import THETA
+from ephemeris import open_cache
+from integrators import INTEGRATORS
+from sim_output import FORMATS, TrajectoryWriter
+from simulator import AU, DAY_STEP, SIM_START_DATE, URANUS_REVOLUTION_TIME, loop, make_bodies, output_steps
+
+RUN_DEFAULTS = {
+    'epoch': SIM_START_DATE,
+    'integrator': 'euler',
+    'day_step': DAY_STEP,
+    'days': URANUS_REVOLUTION_TIME,
+    'output_days': DAY_STEP,
+    'format': 'csv',
+    'gravity': 'direct',
+    'theta': THETA,
+    'masses': {},  # body name: mass factor
+    'dr': 0.0,  # m, std of the position perturbation (per axis)
+    'dv': 0.0,  # m/s, std of the velocity perturbation (per axis)
+    'seed': None,
+    'offline': False,  # vectors from the ephemeris cache or the standin file only
+    'standin': None,
+    'standin_any_date': False,  # the standin vectors whatever their date, else an error
+}
+
+GRAVITIES = ('direct', 'tree')
+# keys of a run besides RUN_DEFAULTS
+RUN_KEYS = ('name',)
+
+SUMMARY_COLUMNS = ('run', 'epoch', 'body', 'dmin', 'dmax', 'vmin', 'vmax', 'energy_error', 'angular_momentum_error')
+
+
+def check_run(run):
+    """Raises ValueError for a run that the simulator would reject, before it reaches a worker."""
+    name = run.get('name') or run['epoch']
+    unknown = set(run) - set(RUN_DEFAULTS) - set(RUN_KEYS)
+    if unknown:
+        raise ValueError('Run %s: unknown keys %s' % (name, ', '.join(sorted(unknown))))
+    for (key, choices) in (('integrator', INTEGRATORS), ('format', FORMATS), ('gravity', GRAVITIES)):
+        if run[key] not in choices:
+            raise ValueError('Run %s: unknown %s "%s", expected one of %s' % (name, key, run[key], ', '.join(choices)))
+    if run['gravity'] == 'tree' and run['integrator'] == 'wh':
+        raise ValueError('Run %s: the wh integrator computes its own planet-planet kicks, use gravity direct' % name)
+
+
+def perturb(bodies, run):
+    """Applies the mass factors and the position/velocity perturbations of the run."""
+    for body in bodies:
+        if body.name in run['masses']:
+            body.mass *= run['masses'][body.name]
+    unknown = set(run['masses']) - set(body.name for body in bodies)
+    if unknown:
+        raise ValueError('Unknown bodies in masses: %s' % ', '.join(sorted(unknown)))
+
+    if run['dr'] or run['dv']:
+        rng = np.random.default_rng(run['seed'])
+        for body in bodies[1:]:
+            dx, dy, dz = rng.normal(0, run['dr'], 3)
+            dvx, dvy, dvz = rng.normal(0, run['dv'], 3)
+            body.px, body.py, body.pz = body.px + dx, body.py + dy, body.pz + dz
+            body.vx, body.vy, body.vz = body.vx + dvx, body.vy + dvy, body.vz + dvz
+
+
+def run_member(run):
+    """
+    One run of the ensemble, in a worker process: returns its summary rows
+    (dicts of SUMMARY_COLUMNS), or raises.
+    """
+    folder = run['folder']
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'params.json'), 'w') as f:
+        json.dump(run, f, indent=1)
+
+    with open(os.path.join(folder, 'run.log'), 'w') as log, contextlib.redirect_stdout(log):
+        cache = open_cache(offline=run['offline'], standin=run['standin'], any_date=run['standin_any_date'])
+        bodies = make_bodies(run['epoch'], os.path.join(folder, 'planets.json'), cache)
+        perturb(bodies, run)
+        basename = os.path.join(folder, 'trajectory')
+        n_samples = len(output_steps(run['output_days'], run['day_step'], run['days']))
+        with TrajectoryWriter(basename, [body.name for body in bodies], run['format'], n_samples) as writer:
+            monitor = loop(bodies, writer, run['output_days'], True, run['integrator'], run['day_step'],
+                           run['days'], basename + '_conservation.csv', None, run['gravity'], run['theta'],
+                           diagnostics_file=basename + '_events.csv')
+
+    energy_error, momentum_error = monitor.max_errors()
+    return [{
+        'run': run['name'],
+        'epoch': run['epoch'],
+        'body': body.name,
+        'dmin': body.dmin / AU,
+        'dmax': body.dmax / AU,
+        'vmin': body.vmin,
+        'vmax': body.vmax,
+        'energy_error': energy_error,
+        'angular_momentum_error': momentum_error,
+    } for body in bodies]
+
+
+def make_runs(base, epochs, run_list, clones, outdir):
+    """
+    The runs of the ensemble: base (RUN_DEFAULTS and the command line)
+    updated by every entry of run_list, or one run per epoch, each cloned
+    clones times with seeds base seed, +1... Each gets a name (the given
+    one or <index>_<date>, plus _<clone>) and a folder. Raises ValueError
+    for an invalid run (check_run).
+    """
+    runs = [dict(base, **entry) for entry in run_list] + [dict(base, epoch=epoch) for epoch in epochs]
+    if not runs:
+        runs = [dict(base)]
+    for run in runs:
+        check_run(run)
+
+    members = []
+    for (k, run) in enumerate(runs):
+        name = run.get('name') or '%03d_%s' % (k, run['epoch'].split()[0])
+        for clone in range(clones):
+            member = dict(run, name=name)
+            if clones > 1:
+                member['name'] = '%s_%02d' % (name, clone)
+                member['seed'] = (run['seed'] or 0) + clone
+            member['folder'] = os.path.join(outdir, member['name'])
+            members.append(member)
+
+    names = [member['name'] for member in members]
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate run names')
+    return members
+
+
+def run_safely(run):
+    """(name, summary rows, None) of a run, or (name, None, error message) if it raised."""
+    try:
+        return run['name'], run_member(run), None
+    except Exception as e:
+        return run['name'], None, ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+
+def run_ensemble(runs, jobs=None):
+    """
+    Runs all the runs on jobs worker processes (default: all the cores),
+    returns (summary rows, {name: error message} of the failed runs).
+    """
+    jobs = jobs or os.cpu_count()
+    # one numpy thread per worker, the pool already uses all the cores
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ.setdefault(var, '1')
+
+    rows = []
+    failed = {}
+    context = multiprocessing.get_context('spawn')
+    # maxtasksperchild: a new worker process for every run
+    with context.Pool(min(jobs, len(runs)), maxtasksperchild=1) as pool:
+        for (done, (name, run_rows, error)) in enumerate(pool.imap_unordered(run_safely, runs), 1):
+            if error is None:
+                rows += run_rows
+                print("[%d/%d] %s" % (done, len(runs), name))
+            else:
+                failed[name] = error
+                print("[%d/%d] %s FAILED: %s" % (done, len(runs), name, failed[name]))
+    rows.sort(key=lambda row: row['run'])
+    return rows, failed
+
+
+def write_summary(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def print_summary(rows):
+    """Spread over the runs of the extremes of every body."""
+    print()
+    print('%-8s %23s %23s %23s %23s' % ('', 'D(min) (au)', 'D(max) (au)', 'V(min) (m/s)', 'V(max) (m/s)'))
+    bodies = list(dict.fromkeys(row['body'] for row in rows))
+    for body in bodies:
+        values = [row for row in rows if row['body'] == body]
+        print('%-8s' % body + ''.join(
+            ' %11.6g..%-10.6g' % (min(r[c] for r in values), max(r[c] for r in values))
+            for c in ('dmin', 'dmax', 'vmin', 'vmax')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('runs', nargs='?', help="JSON list of runs")
+    parser.add_argument('--epochs', nargs='+', default=[], help="start dates, one run each")
+    parser.add_argument('--clones', type=int, default=1, help="perturbed copies of every run (default: %(default)s)")
+    parser.add_argument('--dr', type=float, default=0.0, help="position perturbation std, m (default: %(default)s)")
+    parser.add_argument('--dv', type=float, default=0.0, help="velocity perturbation std, m/s (default: %(default)s)")
+    parser.add_argument('--seed', type=int, help="seed of the first clone")
+    parser.add_argument('--mass', nargs='+', default=[], metavar='BODY=FACTOR', help="mass factors, e.g. Jupiter=1.01")
+    parser.add_argument('--integrator', choices=INTEGRATORS, default=RUN_DEFAULTS['integrator'])
+    parser.add_argument('--day-step', type=float, default=RUN_DEFAULTS['day_step'])
+    parser.add_argument('--days', type=float, default=RUN_DEFAULTS['days'])
+    parser.add_argument('--output-days', type=float, default=RUN_DEFAULTS['output_days'])
+    parser.add_argument('--format', choices=FORMATS, default=RUN_DEFAULTS['format'])
+    parser.add_argument('--offline', action='store_true',
+                        help="no Horizons query: the vectors from the cache, else from --standin")
+    parser.add_argument('--standin', help="planets.json-like file of the vectors missing from the cache")
+    parser.add_argument('--standin-any-date', action='store_true',
+                        help="use the --standin vectors even when its date is not the epoch of the run")
+    parser.add_argument('--jobs', type=int, help="worker processes (default: all the cores)")
+    parser.add_argument('--outdir', default='ensemble', help="(default: %(default)s)")
+    args = parser.parse_args()
+
+    base = dict(RUN_DEFAULTS)
+    base.update(integrator=args.integrator, day_step=args.day_step, days=args.days, output_days=args.output_days,
+                format=args.format, offline=args.offline, standin=args.standin,
+                standin_any_date=args.standin_any_date, dr=args.dr, dv=args.dv, seed=args.seed,
+                masses=dict((k, float(v)) for (k, v) in (m.split('=') for m in args.mass)))
+    run_list = []
+    if args.runs:
+        with open(args.runs, 'r') as f:
+            run_list = json.load(f)
+    try:
+        runs = make_runs(base, args.epochs, run_list, args.clones, args.outdir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.outdir, exist_ok=True)
+    print("%d runs on %d processes" % (len(runs), min(args.jobs or os.cpu_count(), len(runs))))
+    rows, failed = run_ensemble(runs, args.jobs)
+    summary = os.path.join(args.outdir, 'summary.csv')
+    write_summary(summary, rows)
+    if rows:
+        print_summary(rows)
+    print()
+    print("summary: %s, %d runs, %d failed" % (summary, len(runs) - len(failed), len(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+#
+# Local cache of the Horizons state vectors used as initial conditions:
+# every vector fetched from astroquery.jplhorizons is appended to a csv
+# keyed by (body id, epoch, center), read once per process into an
+# in-memory index, so that repeated runs and ensembles only query Horizons
+# for the vectors they never fetched. Offline, nothing is queried: the
+# vectors come from the cache or from a stand-in file (the planets.json
+# format of simulator.Horizon) of the same date, or of any date if asked.
+#
+
+import json
+import os
+
+import numpy as np
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'horizons_cache.csv')
+CENTER = '@sun'
+COLUMNS = ('id', 'jd', 'center', 'x', 'y', 'z', 'vx', 'vy', 'vz')
+
+_caches = {}
+
+
+def epoch_key(jd):
+    # to the millisecond, the Time(...).jd of a date string is not always
+    # the same float
+    return '%.8f' % jd
+
+
+class EphemerisCache:
+    """
+    filename: the csv, one row per vector (COLUMNS: position in au,
+    velocity in au/day), appended to; several processes can share it
+    offline: never query Horizons, a vector missing from the cache is read
+    from the standin file, or is an error
+    any_date: the standin vectors are used even when the standin date is
+    not the requested one (with a warning), else that is an error
+    """
+    def __init__(self, filename=CACHE_FILE, offline=False, standin=None, any_date=False):
+        self.filename = filename
+        self.offline = offline
+        self.standin = standin
+        self.any_date = any_date
+        self.index = None
+        self.standin_data = None
+        self.standin_key = None
+        self.warned = set()
+        self.fetched = 0
+
+    def load(self):
+        """The in-memory index {(id, epoch key, center): (r, v)}, read on first use."""
+        if self.index is None:
+            self.index = {}
+            if os.path.exists(self.filename):
+                with open(self.filename, 'r') as f:
+                    for line in f:
+                        if line.startswith('#') or not line.strip():
+                            continue
+                        fields = line.strip().split(',')
+                        if len(fields) != len(COLUMNS):
+                            # a row still being written by another run
+                            continue
+                        body_id, jd, center = fields[:3]
+                        values = [float(x) for x in fields[3:]]
+                        self.index[(body_id, jd, center)] = (values[:3], values[3:])
+        return self.index
+
+    def vectors(self, body_id, jd, center=CENTER, date=None):
+        """([x, y, z] au, [vx, vy, vz] au/day) of body_id at the Julian date jd."""
+        key = (str(body_id), epoch_key(jd), center)
+        index = self.load()
+        if key in index:
+            return index[key]
+        if self.offline:
+            return self.from_standin(body_id, jd, date)
+
+        r, v = self.fetch(body_id, jd, center)
+        index[key] = (r, v)
+        self.append(key, r, v)
+        return r, v
+
+    def fetch(self, body_id, jd, center):
+        from astroquery.jplhorizons import Horizons
+
+        obj = Horizons(id=body_id, location=center, epochs=jd, id_type='id').vectors()
+        self.fetched += 1
+        return ([float(np.double(obj[xi])) for xi in ['x', 'y', 'z']],
+                [float(np.double(obj[vxi])) for vxi in ['vx', 'vy', 'vz']])
+
+    def append(self, key, r, v):
+        # one write per line, in append mode: concurrent runs do not
+        # interleave their rows (at worst a vector is fetched twice)
+        new = not os.path.exists(self.filename)
+        with open(self.filename, 'a') as f:
+            f.write(('#' + ','.join(COLUMNS) + '\n' if new else '') +
+                    ','.join(list(key) + ['%.17g' % x for x in list(r) + list(v)]) + '\n')
+
+    def from_standin(self, body_id, jd, date):
+        if self.standin is None:
+            raise ValueError('Offline: no cached vector of body %s at %s and no stand-in file' % (body_id, date or jd))
+        if self.standin_data is None:
+            from astropy.time import Time
+
+            with open(self.standin) as json_file:
+                self.standin_data = json.load(json_file)
+            standin_date = self.standin_data.get('date')
+            self.standin_key = None if standin_date is None else epoch_key(Time(standin_date).jd)
+        # checked at every call: a process can build the bodies of several dates
+        if self.standin_key != epoch_key(jd):
+            if not self.any_date:
+                raise ValueError('Offline: no cached vector of body %s at %s and the stand-in %s is of %s' % (
+                    body_id, date or jd, self.standin, self.standin_data.get('date')))
+            if epoch_key(jd) not in self.warned:
+                self.warned.add(epoch_key(jd))
+                print('Warning: offline, the vectors of %s are taken from %s, of %s' % (
+                    date or jd, self.standin, self.standin_data.get('date')))
+        entry = self.standin_data[str(body_id)]
+        return entry['r'], entry['v']
+
+
+def open_cache(filename=CACHE_FILE, offline=False, standin=None, any_date=False):
+    """The EphemerisCache of these settings, one per process: its file is read once."""
+    key = (os.path.abspath(filename), offline, standin, any_date)
+    if key not in _caches:
+        _caches[key] = EphemerisCache(filename, offline, standin, any_date)
+    return _caches[key]
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+#
+# Integrators of the solar-system simulator, all symplectic, stepping the
+# state of an nbody.NBodyEngine in place:
+#
+#   euler     the original loop: velocities, then positions (1st order)
+#   leapfrog  velocity Verlet, kick-drift-kick (2nd order, 1 force/step)
+#   yoshida4  Yoshida's composition of three leapfrogs (4th order, 3 forces)
+#   wh        Wisdom-Holman in democratic heliocentric coordinates: exact
+#             Kepler orbits around body 0 (the Sun), the planet-planet
+#             interactions as kicks (2nd order in the planet/Sun mass ratio,
+#             the step can be a fraction of the shortest period)
+#
+# The test particles of the engine, if any, are stepped with the same
+# scheme, as one batch.
+#
+
+import numpy as np
+
+from nbody import G
+
+INTEGRATORS = ('euler', 'leapfrog', 'yoshida4', 'wh')
+
+KEPLER_TOL = 1e-14
+KEPLER_MAX_ITER = 50
+
+
+class SymplecticEuler:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def step(self, dt):
+        self.engine.step(dt)
+
+    def reset(self):
+        """The engine state was changed from outside."""
+        pass
+
+
+class Leapfrog:
+    def __init__(self, engine):
+        self.engine = engine
+        self.reset()
+
+    def reset(self):
+        self.acc = self.engine.all_accelerations()
+
+    def step(self, dt):
+        engine = self.engine
+        engine.kick(self.acc, dt/2)
+        engine.drift(dt)
+        self.acc = engine.all_accelerations()
+        engine.kick(self.acc, dt/2)
+
+
+# Yoshida 1990, 4th order: drift c_i, kick d_i
+_W1 = 1 / (2 - 2**(1/3))
+_W0 = -2**(1/3) / (2 - 2**(1/3))
+YOSHIDA_C = (_W1/2, (_W0+_W1)/2, (_W0+_W1)/2, _W1/2)
+YOSHIDA_D = (_W1, _W0, _W1)
+
+
+class Yoshida4:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def reset(self):
+        pass
+
+    def step(self, dt):
+        engine = self.engine
+        for i in range(3):
+            engine.drift(YOSHIDA_C[i]*dt)
+            engine.kick(engine.all_accelerations(), YOSHIDA_D[i]*dt)
+        engine.drift(YOSHIDA_C[3]*dt)
+
+
+def kepler_drift(pos, vel, mu, dt, allow_unbound=False):
+    """
+    Advances the bound two-body orbits (pos, vel) (n, D) around a central
+    mass mu by dt, with the f and g functions of the eccentric anomaly
+    change. In place.
+
+    allow_unbound: the unbound rows (test particles, discarded after the
+    step) only move in a straight line, instead of an error
+    """
+    r0 = np.sqrt(np.einsum('ij,ij->i', pos, pos))
+    v2 = np.einsum('ij,ij->i', vel, vel)
+    a = 1 / (2/r0 - v2/mu)
+    unbound = ~(a > 0)
+    if unbound.any():
+        if not allow_unbound:
+            raise ValueError('Unbound orbit around the central body, the wh integrator needs elliptic orbits')
+        pos[unbound] += vel[unbound]*dt
+        bound = ~unbound
+        p, v = pos[bound], vel[bound]
+        kepler_drift(p, v, mu, dt)
+        pos[bound] = p
+        vel[bound] = v
+        return
+
+    n = np.sqrt(mu / a**3)
+    sigma0 = np.einsum('ij,ij->i', pos, vel) / np.sqrt(mu)
+    sqrt_a = np.sqrt(a)
+    # Kepler equation for x = ΔE: n dt = x - (1 - r0/a) sin x + sigma0/sqrt(a) (1 - cos x)
+    e_cos = 1 - r0/a
+    e_sin = sigma0 / sqrt_a
+    mean = n*dt
+    x = mean.copy()
+    for _ in range(KEPLER_MAX_ITER):
+        s, c = np.sin(x), np.cos(x)
+        f = x - e_cos*s + e_sin*(1 - c) - mean
+        dx = f / (1 - e_cos*c + e_sin*s)
+        x -= dx
+        if np.all(np.abs(dx) < KEPLER_TOL):
+            break
+
+    s, c = np.sin(x), np.cos(x)
+    r = a + (r0 - a)*c + sigma0*sqrt_a*s
+    f = 1 - a/r0*(1 - c)
+    g = dt + (s - x)/n
+    fdot = -np.sqrt(mu*a)/(r*r0)*s
+    gdot = 1 - a/r*(1 - c)
+
+    new_pos = f[:, None]*pos + g[:, None]*vel
+    vel[:] = fdot[:, None]*pos + gdot[:, None]*vel
+    pos[:] = new_pos
+
+
+class WisdomHolman:
+    """
+    Democratic heliocentric split (Duncan, Levison and Lee 1998): Q the
+    positions relative to body 0, V the barycentric velocities. A step is
+    interaction kick and Sun drift for dt/2, Kepler drift for dt, then Sun
+    drift and interaction kick for dt/2. The test particles get the same
+    Sun drift and Kepler drift, and the kicks of the bodies but body 0.
+    The engine state is written back after every step.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        mass = engine.mass
+        self.mu = G * mass[0]
+        self.m = mass[1:]
+        self.total = np.sum(mass)
+        # planet-planet pairs only
+        self.pairs = np.triu_indices(len(self.m), 1)
+        self.reset()
+
+    def reset(self):
+        engine = self.engine
+        mass = engine.mass
+        self.cm = mass @ engine.pos / self.total
+        self.vcm = mass @ engine.vel / self.total
+        self.Q = engine.pos[1:] - engine.pos[0]
+        self.V = engine.vel[1:] - self.vcm
+        particles = engine.particles
+        if particles is not None:
+            self.particle_Q = particles.pos - engine.pos[0]
+            self.particle_V = particles.vel - self.vcm
+
+    def interaction(self, dt):
+        i, j = self.pairs
+        d = self.Q[j] - self.Q[i]
+        r2 = np.einsum('ij,ij->i', d, d)
+        d /= (r2*np.sqrt(r2))[:, None]
+        acc = np.empty_like(self.Q)
+        n = len(self.m)
+        for axis in range(self.Q.shape[1]):
+            acc[:, axis] = (np.bincount(i, d[:, axis]*self.m[j], minlength=n)
+                            - np.bincount(j, d[:, axis]*self.m[i], minlength=n))
+        self.V += G*acc*dt
+        if self.engine.particles is not None:
+            self.particle_V += self.engine.particles.accelerations(self.Q, self.m, self.particle_Q)*dt
+
+    def sun_drift(self, dt):
+        jump = (self.m @ self.V) / self.engine.mass[0] * dt
+        self.Q += jump
+        if self.engine.particles is not None:
+            self.particle_Q += jump
+
+    def step(self, dt):
+        self.interaction(dt/2)
+        self.sun_drift(dt/2)
+        kepler_drift(self.Q, self.V, self.mu, dt)
+        if self.engine.particles is not None:
+            kepler_drift(self.particle_Q, self.particle_V, self.mu, dt, allow_unbound=True)
+        self.sun_drift(dt/2)
+        self.interaction(dt/2)
+        self.cm += self.vcm*dt
+        self.store()
+
+    def store(self):
+        engine = self.engine
+        engine.pos[0] = self.cm - self.m @ self.Q / self.total
+        engine.pos[1:] = self.Q + engine.pos[0]
+        engine.vel[1:] = self.V + self.vcm
+        engine.vel[0] = self.vcm - self.m @ self.V / engine.mass[0]
+        particles = engine.particles
+        if particles is not None:
+            particles.pos[:] = self.particle_Q + engine.pos[0]
+            particles.vel[:] = self.particle_V + self.vcm
+
+    def arrays(self):
+        """
+        State for a checkpoint (checkpoint.save_checkpoint): the split
+        variables, which the engine positions and velocities only give back
+        to rounding.
+        """
+        arrays = {'wh_cm': self.cm, 'wh_vcm': self.vcm, 'wh_Q': self.Q, 'wh_V': self.V}
+        if self.engine.particles is not None:
+            arrays.update({'wh_particle_Q': self.particle_Q, 'wh_particle_V': self.particle_V})
+        return arrays
+
+    def restore(self, checkpoint):
+        if 'wh_Q' not in checkpoint:
+            return
+        self.cm = checkpoint['wh_cm'].copy()
+        self.vcm = checkpoint['wh_vcm'].copy()
+        self.Q = checkpoint['wh_Q'].copy()
+        self.V = checkpoint['wh_V'].copy()
+        if self.engine.particles is not None:
+            self.particle_Q = checkpoint['wh_particle_Q'].copy()
+            self.particle_V = checkpoint['wh_particle_V'].copy()
+
+
+def make_integrator(name, engine):
+    if name == 'euler':
+        return SymplecticEuler(engine)
+    if name == 'leapfrog':
+        return Leapfrog(engine)
+    if name == 'yoshida4':
+        return Yoshida4(engine)
+    if name == 'wh':
+        return WisdomHolman(engine)
+    raise ValueError('Unknown integrator "%s", expected one of %s' % (name, ', '.join(INTEGRATORS)))
+
+
+class ConservationMonitor:
+    """
+    Total energy and angular momentum of the engine, sampled along the run.
+    samples: rows of t (days), E (J), |L| (kg m^2/s), relative errors of E
+    and L (vector difference) against the first sample.
+    """
+    COLUMNS = ('t', 'energy', 'angular_momentum', 'energy_error', 'angular_momentum_error')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.samples = []
+        self.e0 = None
+        self.l0 = None
+
+    def sample(self, t):
+        energy = self.engine.energy()
+        momentum = self.engine.angular_momentum()
+        if self.e0 is None:
+            self.e0, self.l0 = energy, momentum
+        self.samples.append((
+            t / 86400, energy, np.linalg.norm(momentum),
+            abs((energy - self.e0) / self.e0),
+            np.linalg.norm(momentum - self.l0) / np.linalg.norm(self.l0),
+        ))
+
+    def max_errors(self):
+        """(max relative energy error, max relative angular momentum error)"""
+        samples = np.array(self.samples)
+        return samples[:, 3].max(), samples[:, 4].max()
+
+    def write(self, filename):
+        np.savetxt(filename, np.array(self.samples), fmt='%.17g', delimiter=',', header=','.join(self.COLUMNS))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+#
+# Array state of the solar-system simulator: masses, positions and
+# velocities of all the bodies as (N,) and (N, D) float64 arrays, with the
+# accelerations of all the pairs in one vectorised pass, plus optional
+# massless test particles that only feel these bodies.
+#
+
+import numpy as np
+
+G = 6.67428e-11
+
+# test particles are discarded beyond this distance from body 0 (the Sun),
+# closer than PARTICLE_MIN_DISTANCE or once unbound from it
+PARTICLE_MAX_DISTANCE = 1.5e13  # m, 100 au
+PARTICLE_MIN_DISTANCE = 7e8  # m, the Sun radius
+
+
+class NBodyEngine:
+    """
+    mass: (N,) kg
+    pos, vel: (N, D) m and m/s, D = 2 (planar) or 3
+    dmin, dmax, vmin, vmax: (N,) running extremes of the distance and speed
+    from the origin, updated by update_extremes()
+    particles: TestParticles or None, integrated along with the bodies
+    """
+    def __init__(self, mass, pos, vel, names=None):
+        self.mass = np.array(mass, dtype=np.float64)
+        self.pos = np.array(pos, dtype=np.float64)
+        self.vel = np.array(vel, dtype=np.float64)
+        self.names = list(names) if names is not None else ['#%d' % i for i in range(len(self.mass))]
+        assert self.pos.shape == self.vel.shape == (len(self.mass), self.pos.shape[1]), "inconsistent state arrays"
+
+        n = len(self.mass)
+        self._pairs = None
+
+        self.dmin = np.full(n, np.inf)
+        self.dmax = np.zeros(n)
+        self.vmin = np.full(n, np.inf)
+        self.vmax = np.zeros(n)
+
+        self.particles = None
+
+    @classmethod
+    def from_planets(cls, planets, dim=2, **kwargs):
+        """Engine on the state of the planets, which then become views over its arrays."""
+        engine = cls(
+            [p.mass for p in planets],
+            [p.position()[:dim] for p in planets],
+            [p.velocity()[:dim] for p in planets],
+            [p.name for p in planets],
+            **kwargs
+        )
+        for (i, p) in enumerate(planets):
+            p.bind(engine, i)
+        return engine
+
+    def add_particles(self, pos, vel):
+        """(M, D) positions and velocities, in the frame of the bodies."""
+        self.particles = TestParticles(pos, vel)
+        return self.particles
+
+    @property
+    def pairs(self):
+        # each pair once, i < j: the force on j is the opposite of the one on
+        # i; built on first use, the tree engine never needs them
+        if self._pairs is None:
+            self._pairs = np.triu_indices(len(self.mass), 1)
+        return self._pairs
+
+    def n_bodies(self):
+        return len(self.mass)
+
+    def dim(self):
+        return self.pos.shape[1]
+
+    def accelerations(self, pos=None):
+        """(N, D) accelerations for the positions pos (default: the current state)."""
+        pos = self.pos if pos is None else pos
+        i, j = self.pairs
+        d = pos[j] - pos[i]
+        r2 = np.einsum('ij,ij->i', d, d)
+
+        if not np.all(r2):
+            k = np.flatnonzero(r2 == 0)[0]
+            raise ValueError("Collision between objects %r and %r" % (self.names[i[k]], self.names[j[k]]))
+
+        # G d / |d|^3, towards j for i and towards i for j
+        d /= (r2*np.sqrt(r2))[:, None]
+        acc = np.empty_like(pos)
+        n = len(self.mass)
+        for axis in range(pos.shape[1]):
+            acc[:, axis] = (np.bincount(i, d[:, axis]*self.mass[j], minlength=n)
+                            - np.bincount(j, d[:, axis]*self.mass[i], minlength=n))
+        return G*acc
+
+    def all_accelerations(self):
+        """(bodies, particles) accelerations, particles None without test particles."""
+        if self.particles is None:
+            return self.accelerations(), None
+        return self.accelerations(), self.particles.accelerations(self.pos, self.mass)
+
+    def kick(self, accelerations, dt):
+        acc, particle_acc = accelerations
+        self.vel += acc*dt
+        if particle_acc is not None:
+            self.particles.vel += particle_acc*dt
+
+    def drift(self, dt):
+        self.pos += self.vel*dt
+        if self.particles is not None:
+            self.particles.pos += self.particles.vel*dt
+
+    def step(self, dt):
+        """Symplectic Euler, like the original loop: velocities first, then positions."""
+        self.kick(self.all_accelerations(), dt)
+        self.drift(dt)
+
+    def distances(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.pos, self.pos))
+
+    def speeds(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.vel, self.vel))
+
+    def update_extremes(self):
+        """Updates dmin/dmax/vmin/vmax, returns the (distances, speeds) of the current state."""
+        d = self.distances()
+        v = self.speeds()
+        np.minimum(self.dmin, d, out=self.dmin)
+        np.maximum(self.dmax, d, out=self.dmax)
+        # as the original loop: a zero vmin (the Sun at rest) is never updated
+        np.copyto(self.vmin, v, where=(v <= self.vmin) & (self.vmin != 0))
+        np.maximum(self.vmax, v, out=self.vmax)
+        return d, v
+
+    def energy(self):
+        """Total energy, kinetic plus the potential of every pair (J)."""
+        kinetic = 0.5 * np.sum(self.mass * np.einsum('ij,ij->i', self.vel, self.vel))
+        i, j = self.pairs
+        d = self.pos[j] - self.pos[i]
+        potential = -G * np.sum(self.mass[i]*self.mass[j] / np.sqrt(np.einsum('ij,ij->i', d, d)))
+        return kinetic + potential
+
+    def angular_momentum(self):
+        """Total angular momentum sum(m r x v), (3,) (kg m^2/s)."""
+        pos = self.pos
+        vel = self.vel
+        if self.dim() == 2:
+            pos = np.column_stack((pos, np.zeros(len(pos))))
+            vel = np.column_stack((vel, np.zeros(len(vel))))
+        return np.sum(self.mass[:, None] * np.cross(pos, vel), axis=0)
+
+
+class TestParticles:
+    """
+    Massless bodies: they feel the bodies of the engine but do not act on
+    them nor on each other, so M particles cost O(N M), in one vectorised
+    pass per body.
+
+    pos, vel: (M, D) of the particles still integrated
+    ids: (M,) their index in the initial set
+    dmin, dmax: (M0,) running extremes of the distance from body 0 of all
+    the initial particles, by id
+    removed: (id, t, reason) of the discarded particles
+    """
+    def __init__(self, pos, vel):
+        self.pos = np.array(pos, dtype=np.float64)
+        self.vel = np.array(vel, dtype=np.float64)
+        self.ids = np.arange(len(self.pos))
+        self.dmin = np.full(len(self.pos), np.inf)
+        self.dmax = np.zeros(len(self.pos))
+        self.removed = []
+
+    def __len__(self):
+        return len(self.pos)
+
+    def accelerations(self, body_pos, body_mass, pos=None):
+        pos = self.pos if pos is None else pos
+        acc = np.zeros_like(pos)
+        for (p, m) in zip(body_pos, body_mass):
+            d = p - pos
+            r2 = np.einsum('ij,ij->i', d, d)
+            acc += d * (G*m / (r2*np.sqrt(r2)))[:, None]
+        return acc
+
+    def update_extremes(self, center):
+        d = self.pos - center
+        d = np.sqrt(np.einsum('ij,ij->i', d, d))
+        self.dmin[self.ids] = np.minimum(self.dmin[self.ids], d)
+        self.dmax[self.ids] = np.maximum(self.dmax[self.ids], d)
+        return d
+
+    def discard(self, t, center_pos, center_vel, center_mass):
+        """
+        Drops the particles too far from, too close to or unbound from the
+        center (body 0), recorded in removed at time t (s). Returns their
+        number, the integrator has to be reset when not 0.
+        """
+        r = self.pos - center_pos
+        v = self.vel - center_vel
+        d = np.sqrt(np.einsum('ij,ij->i', r, r))
+        energy = np.einsum('ij,ij->i', v, v)/2 - G*center_mass/d
+
+        reasons = (
+            ('far', d > PARTICLE_MAX_DISTANCE),
+            ('close', d < PARTICLE_MIN_DISTANCE),
+            ('unbound', energy >= 0),
+        )
+        drop = np.zeros(len(d), dtype=bool)
+        for (reason, mask) in reasons:
+            for k in np.flatnonzero(mask & ~drop):
+                self.removed.append((int(self.ids[k]), t, reason))
+            drop |= mask
+        if not drop.any():
+            return 0
+
+        keep = ~drop
+        self.pos = self.pos[keep]
+        self.vel = self.vel[keep]
+        self.ids = self.ids[keep]
+        return int(drop.sum())
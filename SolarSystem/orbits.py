@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#
+# Two-body orbits: orbital elements to state vectors and back, vectorised
+# over arrays of orbits, and the synthetic small body populations used as test
+# particles (Hildas, Jupiter Trojans).
+#
+
+import numpy as np
+
+from nbody import G
+
+AU = (149.6e6 * 1000)
+
+KEPLER_TOL = 1e-14
+KEPLER_MAX_ITER = 50
+
+# name: (a (au), e, i (deg)) uniform ranges; trojans also get a longitude
+# around the L4/L5 points of Jupiter
+POPULATIONS = {
+    'hilda': ((3.7, 4.2), (0.0, 0.3), (0.0, 20.0)),
+    'trojan': ((5.05, 5.35), (0.0, 0.15), (0.0, 30.0)),
+}
+TROJAN_SPREAD = 15.0  # deg, around ±60° from Jupiter
+
+
+def eccentric_anomaly(M, e):
+    """Solves Kepler's equation M = E - e sin E (elliptic orbits), arrays."""
+    E = np.where(e < 0.8, M, np.pi)
+    for _ in range(KEPLER_MAX_ITER):
+        dE = (E - e*np.sin(E) - M) / (1 - e*np.cos(E))
+        E = E - dE
+        if np.all(np.abs(dE) < KEPLER_TOL):
+            break
+    return E
+
+
+def elements_to_state(a, e, i, node, peri, M, mu):
+    """
+    (n, 3) positions (m) and velocities (m/s) relative to the central body
+    of the elliptic orbits: a (m), e, i, node (Ω), peri (ω) and mean
+    anomaly M (rad), central mu = G*mass.
+    """
+    a, e, i, node, peri, M = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (a, e, i, node, peri, M)])
+    E = eccentric_anomaly(M, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = a*np.sqrt(1 - e**2)
+    r = a*(1 - e*cos_E)
+    n = np.sqrt(mu / a**3)
+
+    # perifocal frame
+    x = a*(cos_E - e)
+    y = b*sin_E
+    vx = -a*n*sin_E*a/r
+    vy = b*n*cos_E*a/r
+
+    # perifocal to reference frame: Rz(node) Rx(i) Rz(peri)
+    cn, sn = np.cos(node), np.sin(node)
+    ci, si = np.cos(i), np.sin(i)
+    cp, sp = np.cos(peri), np.sin(peri)
+    p = np.stack((cn*cp - sn*sp*ci, sn*cp + cn*sp*ci, sp*si), axis=-1)
+    q = np.stack((-cn*sp - sn*cp*ci, -sn*sp + cn*cp*ci, cp*si), axis=-1)
+
+    pos = x[:, None]*p + y[:, None]*q
+    vel = vx[:, None]*p + vy[:, None]*q
+    return pos, vel
+
+
+def state_to_elements(pos, vel, mu):
+    """
+    Osculating elements of the (n, 3) positions (m) and velocities (m/s)
+    relative to the central body, central mu = G*(masses): a (m, negative
+    when unbound), e, i, node (Ω), peri (ω) (rad, Ω and ω in [0, 2π)). For
+    i = 0, Ω is 0 and ω the longitude of the perihelion.
+    """
+    pos = np.asarray(pos, dtype=np.float64)
+    vel = np.asarray(vel, dtype=np.float64)
+    r = np.sqrt(np.einsum('ij,ij->i', pos, pos))
+    v2 = np.einsum('ij,ij->i', vel, vel)
+    h = np.cross(pos, vel)
+    h_norm = np.sqrt(np.einsum('ij,ij->i', h, h))
+
+    a = 1 / (2/r - v2/mu)
+    e_vec = np.cross(vel, h) / np.reshape(mu, (-1, 1)) - pos / r[:, None]
+    e = np.sqrt(np.einsum('ij,ij->i', e_vec, e_vec))
+    i = np.arccos(np.clip(h[:, 2] / h_norm, -1, 1))
+
+    # ascending node direction z x h
+    n = np.column_stack((-h[:, 1], h[:, 0], np.zeros(len(h))))
+    n_norm = np.sqrt(np.einsum('ij,ij->i', n, n))
+    planar = n_norm <= 1e-12 * h_norm
+    node = np.where(planar, 0.0, np.arctan2(n[:, 1], n[:, 0]))
+    # angle from the node to the perihelion, in the orbit plane
+    n_dir = np.where(planar[:, None], [1.0, 0.0, 0.0], n / np.where(planar, 1, n_norm)[:, None])
+    peri = np.arctan2(np.einsum('ij,ij->i', np.cross(n_dir, e_vec), h) / h_norm, np.einsum('ij,ij->i', n_dir, e_vec))
+    return a, e, i, np.mod(node, 2*np.pi), np.mod(peri, 2*np.pi)
+
+
+def population(name, n, central_mass, jupiter_pos=None, seed=None):
+    """
+    n random orbits of a POPULATIONS family, heliocentric (pos, vel) (n, 3),
+    in m and m/s. The trojans need the heliocentric position of Jupiter.
+    """
+    if name not in POPULATIONS:
+        raise ValueError('Unknown population "%s", expected one of %s' % (name, ', '.join(POPULATIONS)))
+    (a0, a1), (e0, e1), (i0, i1) = POPULATIONS[name]
+    rng = np.random.default_rng(seed)
+
+    a = rng.uniform(a0, a1, n) * AU
+    e = rng.uniform(e0, e1, n)
+    i = np.radians(rng.uniform(i0, i1, n))
+    node = rng.uniform(0, 2*np.pi, n)
+    peri = rng.uniform(0, 2*np.pi, n)
+    if name == 'trojan':
+        # mean longitude node + peri + M near Jupiter's longitude ±60°
+        jupiter = np.arctan2(jupiter_pos[1], jupiter_pos[0])
+        side = rng.choice((-1, 1), n)
+        longitude = jupiter + np.radians(side*60 + rng.uniform(-TROJAN_SPREAD, TROJAN_SPREAD, n))
+        M = longitude - node - peri
+    else:
+        M = rng.uniform(0, 2*np.pi, n)
+
+    return elements_to_state(a, e, i, node, peri, M, G*central_mass)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+#
+# Trajectory output of the solar-system simulator: the samples are buffered
+# in a preallocated block and written a block at a time, one row per output
+# time and one column per body quantity, instead of an open/append/close of
+# every <Planet>.txt at every step.
+#
+
+import os
+
+import numpy as np
+
+AU = (149.6e6 * 1000)
+DAY = 24 * 3600
+
+FORMATS = ('csv', 'npy', 'planets')
+BLOCK_SIZE = 512
+
+# per body, after the time column
+BODY_COLUMNS = ('d', 'v', 'x', 'y', 'z', 'vx', 'vy', 'vz')
+BODY_UNITS = ('au', 'm/s', 'au', 'au', 'au', 'm/s', 'm/s', 'm/s')
+# the csv has one header row, '# ' and the columns, as the events and
+# conservation csvs: t in days, then the BODY_COLUMNS of each body, of units
+# BODY_UNITS
+
+
+def sample_row(t, pos, vel):
+    """
+    (1 + 8N,) row for time t (s) and the (N, 3) state: time in days, then
+    per body ||pos|| (au), ||vel|| (m/s), pos (au) and vel (m/s).
+    """
+    n = len(pos)
+    row = np.empty((n, len(BODY_COLUMNS)))
+    row[:, 0] = np.sqrt(np.einsum('ij,ij->i', pos, pos)) / AU
+    row[:, 1] = np.sqrt(np.einsum('ij,ij->i', vel, vel))
+    row[:, 2:5] = pos / AU
+    row[:, 5:8] = vel
+    return np.concatenate(([t / DAY], row.ravel()))
+
+
+class TrajectoryWriter:
+    """
+    format:
+        csv: <basename>.csv, header # t,<body>_d,<body>_v,<body>_x,...
+        npy: <basename>.npy, structured float64 array with the same field
+            names, preallocated for n_samples rows and memory-mapped
+        planets: the former <Planet>.txt files, one per body, same columns
+            as the body part of the csv row
+    resume: position() of an interrupted run of the same files, continued
+    from there (anything written after it is dropped)
+    """
+    def __init__(self, basename, names, output_format='csv', n_samples=None, block_size=BLOCK_SIZE, resume=None):
+        if output_format not in FORMATS:
+            raise ValueError('Unknown output format "%s", expected one of %s' % (output_format, ', '.join(FORMATS)))
+        self.names = list(names)
+        self.format = output_format
+        self.columns = ['t'] + ['%s_%s' % (name, c) for name in self.names for c in BODY_COLUMNS]
+        self.buffer = np.empty((block_size, len(self.columns)))
+        self.size = 0
+        self.rows = 0
+
+        if output_format == 'csv':
+            self.filenames = [basename + '.csv']
+            if resume is not None:
+                self.files = self.reopen(resume)
+            else:
+                self.files = [open(self.filenames[0], 'w')]
+                self.files[0].write('# ' + ','.join(self.columns) + '\n')
+        elif output_format == 'npy':
+            if n_samples is None:
+                raise ValueError('The npy output needs the number of samples')
+            self.filenames = [basename + '.npy']
+            dtype = np.dtype([(c, np.float64) for c in self.columns])
+            if resume is not None:
+                self.array = self.regrow(dtype, n_samples, resume['rows'])
+                self.rows = resume['rows']
+            else:
+                self.array = np.lib.format.open_memmap(self.filenames[0], mode='w+', dtype=dtype, shape=(n_samples,))
+            self.files = []
+        else:
+            folder = os.path.dirname(basename)
+            self.filenames = [os.path.join(folder, name + '.txt') for name in self.names]
+            if resume is not None:
+                self.files = self.reopen(resume)
+            else:
+                self.files = [open(filename, 'w') for filename in self.filenames]
+                for f in self.files:
+                    f.write("#||pos (a.u.)||, ||vel (m/s)||, posX, posY, posZ (a.u.), velX, velY, velZ (m/s)\n")
+
+    def reopen(self, resume):
+        # text files, cut back to their size at the checkpoint
+        for (filename, offset) in zip(self.filenames, resume['offsets']):
+            os.truncate(filename, offset)
+        self.rows = resume['rows']
+        return [open(filename, 'a') for filename in self.filenames]
+
+    def regrow(self, dtype, n_samples, rows):
+        # the npy of the interrupted run, in a new file of n_samples rows
+        # when it has to grow (a run extension)
+        old = np.load(self.filenames[0], mmap_mode='r')
+        if old.dtype != dtype:
+            raise ValueError('%s does not have the columns of this run' % self.filenames[0])
+        if len(old) >= n_samples:
+            del old
+            return np.lib.format.open_memmap(self.filenames[0], mode='r+')
+        tmp = self.filenames[0] + '.tmp'
+        array = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(n_samples,))
+        array[:rows] = old[:rows]
+        array.flush()
+        del old
+        os.replace(tmp, self.filenames[0])
+        return array
+
+    def position(self):
+        """Where the output is, all the samples flushed: resume of a later writer."""
+        self.flush()
+        for f in self.files:
+            f.flush()
+        if self.format == 'npy':
+            self.array.flush()
+        return {'rows': self.rows, 'offsets': [f.tell() for f in self.files]}
+
+    def write(self, t, pos, vel):
+        self.buffer[self.size] = sample_row(t, pos, vel)
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        block = self.buffer[:self.size]
+        if self.format == 'csv':
+            np.savetxt(self.files[0], block, fmt='%.17g', delimiter=',')
+        elif self.format == 'npy':
+            if self.rows + self.size > len(self.array):
+                raise ValueError('More samples than the %d allocated' % len(self.array))
+            self.array.view(np.float64).reshape(len(self.array), -1)[self.rows:self.rows+self.size] = block
+        else:
+            width = len(BODY_COLUMNS)
+            for (i, f) in enumerate(self.files):
+                np.savetxt(f, block[:, 1+i*width:1+(i+1)*width], fmt='%.17g', delimiter=',')
+        self.rows += self.size
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+        if self.format == 'npy':
+            self.array.flush()
+            del self.array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trajectory(filename):
+    """(columns, (rows, columns) array) of a csv or npy trajectory."""
+    if filename.endswith('.npy'):
+        data = np.load(filename, mmap_mode='r')
+        return list(data.dtype.names), data.view(np.float64).reshape(len(data), -1)
+    with open(filename, 'r') as f:
+        columns = f.readline().lstrip('#').strip().split(',')
+    return columns, np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+
+
+def write_particles(filename, particles, n_particles):
+    """
+    Final state of the nbody.TestParticles, one row per initial particle:
+    id, x, y, z (au), vx, vy, vz (m/s), dmin, dmax (au), removed (day,
+    nan while integrated), reason (0 integrated, 1 far, 2 close, 3 unbound).
+    """
+    rows = np.full((n_particles, 11), np.nan)
+    rows[:, 0] = np.arange(n_particles)
+    rows[particles.ids, 1:4] = particles.pos / AU
+    rows[particles.ids, 4:7] = particles.vel
+    rows[:, 7] = particles.dmin / AU
+    rows[:, 8] = particles.dmax / AU
+    rows[:, 10] = 0
+    reasons = {'far': 1, 'close': 2, 'unbound': 3}
+    for (i, t, reason) in particles.removed:
+        rows[i, 9] = t / DAY
+        rows[i, 10] = reasons[reason]
+    np.savetxt(filename, rows, fmt='%.17g', delimiter=',',
+               header='id,x,y,z,vx,vy,vz,dmin,dmax,removed,reason')
@@ -4,22 +4,32 @@
 # Adapt from https://fiftyexamples.readthedocs.io/en/latest/gravity.html
 #
 
+import argparse
 import math
-import os
 
 import numpy as np
 import json
 from astropy.time import Time
-from astroquery.jplhorizons import Horizons
+
+from barnes_hut import THETA, BarnesHutEngine
+from checkpoint import load_checkpoint, restore, save_checkpoint
+from diagnostics import OrbitalDiagnostics
+from ephemeris import CACHE_FILE, CENTER, open_cache
+from integrators import INTEGRATORS, ConservationMonitor, make_integrator
+from nbody import G, NBodyEngine
+from orbits import POPULATIONS, population
+from sim_output import FORMATS, TrajectoryWriter, write_particles
 
 names = ['Mercury', 'Venus', 'Earth', 'Mars', 'Jupiter', 'Saturn', 'Uranus', 'Neptune']
 nasaids = [1, 2, 3, 4, 5, 6, 7, 8]   
 
+SIM_START_DATE = "1822-09-23 00:00:00"
+#SIM_START_DATE = "1990-09-23 00:00:00"
+
 DAY_STEP = 10
 URANUS_REVOLUTION_TIME = 30660
 NUM_STEP = URANUS_REVOLUTION_TIME / DAY_STEP
-
-G = 6.67428e-11
+CHECKPOINT_DAYS = 3650
 
 # Assumed scale: 100 pixels = 1AU.
 AU = (149.6e6 * 1000)     # 149.6 million km, in meters.
@@ -30,25 +40,40 @@ class Horizon:
     vx = vy = vz = 0.0
     px = py = pz = 0.0
     size = 0
+    filename = 'planets.json'
+    data = None
+
+    def __init__(self, cache=None):
+        # the vectors come from an ephemeris.EphemerisCache (default: the
+        # shared cache, online)
+        self.cache = cache if cache is not None else open_cache()
 
-    def setInitialCondition(self, sim_start_date):
+    def setInitialCondition(self, sim_start_date, filename='planets.json'):
+        # filename: the vectors are also saved there, unless None
+        jd = Time(sim_start_date).jd
         data = dict(info="Solar planets database, including positions and velocities at the given date", date=sim_start_date)
         for i in range(len(names)):
             nasaid = nasaids[i]
-            obj = Horizons(id=nasaid, location="@sun", epochs=Time(sim_start_date).jd, id_type='id').vectors()
+            r, v = self.cache.vectors(nasaid, jd, CENTER, sim_start_date)
             data[str(nasaid)] = {
                 "name": names[i],
-                "r": [np.double(obj[xi]) for xi in ['x', 'y', 'z']],
-                "v": [np.double(obj[vxi]) for vxi in ['vx', 'vy', 'vz']]
+                "r": list(r),
+                "v": list(v)
             }
-        with open("planets.json", 'w') as f:
-            json.dump(data, f, indent=4)
+        self.data = data
+        if filename is not None:
+            self.filename = filename
+            with open(filename, 'w') as f:
+                json.dump(data, f, indent=4)
 
     def getPlanetInitialCondition(self, positionInSolarSystem):
         if (str(positionInSolarSystem) == '0'):
             return
-        with open('planets.json') as json_file:
-            data = json.load(json_file)
+        # read once, not for every planet
+        if self.data is None:
+            with open(self.filename) as json_file:
+                self.data = json.load(json_file)
+        data = self.data
         self.px, self.py, self.pz  = data[str(positionInSolarSystem)]['r']
         self.vx, self.vy, self.vz  = data[str(positionInSolarSystem)]['v']
         
@@ -58,23 +83,79 @@ class Horizon:
     def getSpeed (self):
         return self.vx * AU_PER_DAY, self.vy * AU_PER_DAY, self.vz * AU_PER_DAY
 
+def _state_property(array, axis):
+    # stored on the planet until it is bound to an engine, then a view over
+    # the engine arrays (an axis the engine does not integrate keeps its value)
+    def fget(self):
+        engine = self.engine
+        if engine is not None and axis < engine.dim():
+            return float(getattr(engine, array)[self.index, axis])
+        return self._state[array][axis]
+
+    def fset(self, value):
+        engine = self.engine
+        if engine is not None and axis < engine.dim():
+            getattr(engine, array)[self.index, axis] = value
+        else:
+            self._state[array][axis] = value
+
+    return property(fget, fset)
+
+
+def _extreme_property(name):
+    def fget(self):
+        if self.engine is not None:
+            return float(getattr(self.engine, name)[self.index])
+        return self._extremes[name]
+
+    def fset(self, value):
+        if self.engine is not None:
+            getattr(self.engine, name)[self.index] = value
+        else:
+            self._extremes[name] = value
+
+    return property(fget, fset)
+
+
 class Planet:
     #mass : mass in kg
-    #vx, vy: x, y velocities in m/s
-    #px, py: x, y positions in m
+    #vx, vy, vz: x, y, z velocities in m/s
+    #px, py, pz: x, y, z positions in m
+    # once bound to an NBodyEngine, the state and the extremes are views
+    # over its arrays
     
     name = 'Planet'
     mass = None
-    vx = vy = vz = 0.0
-    px = py = pz = 0.0
+    engine = None
+    index = None
     vmodulo = 0.0
     dmodulo = 0.0
 
-    dmin = float('inf')
-    dmax = 0.0
-    
-    vmin = float('inf')
-    vmax = 0.0
+    px = _state_property('pos', 0)
+    py = _state_property('pos', 1)
+    pz = _state_property('pos', 2)
+    vx = _state_property('vel', 0)
+    vy = _state_property('vel', 1)
+    vz = _state_property('vel', 2)
+
+    dmin = _extreme_property('dmin')
+    dmax = _extreme_property('dmax')
+    vmin = _extreme_property('vmin')
+    vmax = _extreme_property('vmax')
+
+    def __init__(self):
+        self._state = {'pos': [0.0, 0.0, 0.0], 'vel': [0.0, 0.0, 0.0]}
+        self._extremes = {'dmin': float('inf'), 'dmax': 0.0, 'vmin': float('inf'), 'vmax': 0.0}
+
+    def bind(self, engine, index):
+        self.engine = engine
+        self.index = index
+
+    def position(self):
+        return self.px, self.py, self.pz
+
+    def velocity(self):
+        return self.vx, self.vy, self.vz
 
     def attraction(self, other):
         #Returns the force exerted upon this body by the other body.
@@ -84,11 +165,12 @@ class Planet:
             raise ValueError("Attraction of object %r to itself requested" % self.name)
 
         # Compute the distance of the other body.
-        sx, sy = self.px, self.py
-        ox, oy = other.px, other.py
+        sx, sy, sz = self.px, self.py, self.pz
+        ox, oy, oz = other.px, other.py, other.pz
         dx = (ox-sx)
         dy = (oy-sy)
-        d = math.sqrt(dx**2 + dy**2)
+        dz = (oz-sz)
+        d = math.sqrt(dx**2 + dy**2 + dz**2)
 
         # Report an error if the distance is zero; otherwise we'll
         # get a ZeroDivisionError exception further down.
@@ -99,26 +181,130 @@ class Planet:
         f = G * self.mass * other.mass / (d**2)
 
         # Compute the direction of the force.
-        theta = math.atan2(dy, dx)
-        fx = math.cos(theta) * f
-        fy = math.sin(theta) * f
-        return fx, fy
+        fx = dx / d * f
+        fy = dy / d * f
+        fz = dz / d * f
+        return fx, fy, fz
+
+def output_steps(output_days=DAY_STEP, day_step=DAY_STEP, days=URANUS_REVOLUTION_TIME):
+    # steps (from 1, as in loop) with an output sample: the first step at or
+    # after every multiple of output_days
+    steps = []
+    next_output = 0.0
+    for step in range(1, int(round(days / day_step))+1):
+        day = (step-1) * day_step
+        if day >= next_output:
+            steps.append(step)
+            while next_output <= day:
+                next_output += output_days
+    return steps
+
+def loop(bodies, writer=None, output_days=DAY_STEP, quiet=False, integrator='euler', day_step=DAY_STEP,
+         days=URANUS_REVOLUTION_TIME, conservation_file=None, particles=None, gravity='direct', theta=THETA,
+         checkpoint_file=None, checkpoint_days=None, resume=None, run_info=None, diagnostics_file=None):
+    # same run as loop_reference, on the arrays of an NBodyEngine; the
+    # extremes are updated at every step, the state is printed and given to
+    # the writer (sim_output.TrajectoryWriter) every output_days only, when
+    # the energy and angular momentum are sampled too (written to
+    # conservation_file). Returns the integrators.ConservationMonitor, its
+    # engine holds the final state.
+    # particles: optional (pos, vel) (M, 3) of massless test particles,
+    # integrated along with the bodies (nbody.TestParticles)
+    # gravity: 'direct', all the pairs, or 'tree', a Barnes-Hut octree of
+    # opening angle theta (barnes_hut.BarnesHutEngine)
+    # checkpoint_file: the state is saved there (checkpoint.py) every
+    # checkpoint_days and at the end, with the settings of the run and
+    # run_info; resume: a loaded checkpoint, to continue from its step up to
+    # days (bodies from bodies_from_checkpoint, writer resumed too)
+    # diagnostics_file: the perihelion, aphelion and revolution events of
+    # the bodies (diagnostics.OrbitalDiagnostics), written at the end
+    timestep = 24 * 3600 * day_step
+    num_step = int(round(days / day_step))
+    if gravity == 'tree':
+        engine = BarnesHutEngine.from_planets(bodies, dim=3, theta=theta)
+    else:
+        engine = NBodyEngine.from_planets(bodies, dim=3)
+    if particles is not None:
+        engine.add_particles(*particles)
+    monitor = ConservationMonitor(engine)
+    diagnostics = OrbitalDiagnostics(engine, monitor) if diagnostics_file else None
+    if resume is not None:
+        restore(resume, engine, monitor)
+        if diagnostics is not None:
+            diagnostics.restore(resume)
+    stepper = make_integrator(integrator, engine)
+    if resume is not None and hasattr(stepper, 'restore'):
+        stepper.restore(resume)
+    outputs = set(output_steps(output_days, day_step, days))
+
+    config = dict(run_info or {}, output_days=output_days, integrator=integrator, day_step=day_step, days=days,
+                  gravity=gravity, theta=theta, checkpoint_days=checkpoint_days)
+    checkpoint_steps = max(1, int(round(checkpoint_days / day_step))) if checkpoint_days else None
+
+    def save(step):
+        output = writer.position() if writer is not None else None
+        save_checkpoint(checkpoint_file, engine, step, monitor, config, output, diagnostics, stepper)
+
+    # loop on (day_step * num_step) days
+    step = 1 if resume is None else resume['step']
+    if diagnostics is not None and diagnostics.t is None:
+        diagnostics.update((step-1) * timestep)
+    while step <= num_step:
+        dmodulo, vmodulo = engine.update_extremes()
+        if engine.particles is not None:
+            engine.particles.update_extremes(engine.pos[0])
+
+        if step in outputs:
+            if writer is not None:
+                writer.write((step-1) * timestep, engine.pos, engine.vel)
+            monitor.sample((step-1) * timestep)
+            if not quiet:
+                print()
+                print('Step #{}'.format(step))
+                for (i, body) in enumerate(bodies):
+                    body.dmodulo = dmodulo[i]
+                    body.vmodulo = vmodulo[i]
+                    print (body.name + ' ' + str(body.px/AU) + ',' + str(body.py/AU) + ',' + str(body.pz/AU) + ',' +
+                           str(body.vx) + ',' + str(body.vy) + ',' + str(body.vz) +
+                           ' ==> ' + str(body.dmodulo/AU) + ',' + str(body.vmodulo))
 
-def clean_info_on_file(bodies):
-    for body in bodies:
-       try:
-          os.remove(body.name + ".txt")
-          print('Removing ' + body + '.txt file\n')
-       except:
-          pass
+        step += 1
+        stepper.step(timestep)
+        if engine.particles is not None:
+            if engine.particles.discard((step-1) * timestep, engine.pos[0], engine.vel[0], engine.mass[0]):
+                stepper.reset()
+        if diagnostics is not None:
+            diagnostics.update((step-1) * timestep)
+        if checkpoint_file and checkpoint_steps and (step-1) % checkpoint_steps == 0 and step <= num_step:
+            save(step)
+
+    if checkpoint_file:
+        save(step)
 
+    print()
+    print ('Simulation ran on ' + (str(day_step * num_step))+ ' days, ' + integrator + ' integrator')
+    print ()
     for body in bodies:
-        planetFile = open(body.name + ".txt", "a")
-        #planetFile.write("#posX, posY, velX, velY\n")
-        planetFile.write("#||pos (a.u.)||, ||vel (m/s)||\n")
-        planetFile.close()
-   
-def loop(bodies):
+        print (body.name + ' D(min): ' + str(body.dmin/AU) + ' D(max): ' + str(body.dmax/AU) + ' V(min): ' + str(body.vmin) + ' V(max): ' + str(body.vmax))
+    if engine.particles is not None:
+        removed = engine.particles.removed
+        print ('Test particles: %d integrated, %d discarded (%s)' % (
+            len(engine.particles), len(removed),
+            ', '.join('%s %d' % (reason, sum(1 for r in removed if r[2] == reason)) for reason in ('far', 'close', 'unbound'))))
+    if diagnostics is not None:
+        print ()
+        print ('Periods (days): sidereal from the mean motion, mean of the revolutions, Kepler of the osculating a')
+        for (body, periods) in list(zip(bodies, diagnostics.periods() / (24 * 3600)))[1:]:
+            print (body.name + ' ' + ' '.join('%.2f' % p for p in periods))
+        diagnostics.write(diagnostics_file)
+    print ()
+    print ('Max relative error: energy %.3e, angular momentum %.3e' % monitor.max_errors())
+    if conservation_file:
+        monitor.write(conservation_file)
+    return monitor
+
+def loop_reference(bodies):
+    # the original pairwise Planet.attraction loop
     timestep = 24 * 3600 * DAY_STEP
     
     # loop on (DAY_STEP * NUM_STEP) days
@@ -127,8 +313,8 @@ def loop(bodies):
         print()
         print('Step #{}'.format(step))
         for body in bodies:
-            body.dmodulo = math.sqrt(body.px*body.px + body.py * body.py)
-            body.vmodulo = math.sqrt(body.vx*body.vx + body.vy * body.vy)
+            body.dmodulo = math.sqrt(body.px*body.px + body.py * body.py + body.pz * body.pz)
+            body.vmodulo = math.sqrt(body.vx*body.vx + body.vy * body.vy + body.vz * body.vz)
             
             if (body.dmodulo <= body.dmin):
                 body.dmin = body.dmodulo
@@ -140,14 +326,15 @@ def loop(bodies):
             if (body.vmodulo >= body.vmax):
                 body.vmax = body.vmodulo
 
-            print (body.name + ' ' + str(body.px/AU) + ',' + str(body.py/AU) + ',' + str(body.vx) + ',' + str(body.vy) +
+            print (body.name + ' ' + str(body.px/AU) + ',' + str(body.py/AU) + ',' + str(body.pz/AU) + ',' +
+                   str(body.vx) + ',' + str(body.vy) + ',' + str(body.vz) +
                    ' ==> ' + str(body.dmodulo/AU) + ',' + str(body.vmodulo))
 
             # update info on file
             planetFile = open(body.name + ".txt", "a")
-            #planetFile.write(str(body.px/AU) + ',' + str(body.py/AU) + ',' + str(body.vx) + ',' + str(body.vy) + 
-            #                 str(body.dmodulo/AU) + ',' + str(body.vmodulo) + '\n')
-            planetFile.write(str(body.dmodulo/AU) + ',' + str(body.vmodulo) + '\n')
+            planetFile.write(str(body.dmodulo/AU) + ',' + str(body.vmodulo) + ',' +
+                             str(body.px/AU) + ',' + str(body.py/AU) + ',' + str(body.pz/AU) + ',' +
+                             str(body.vx) + ',' + str(body.vy) + ',' + str(body.vz) + '\n')
             planetFile.close()
 
         step += 1
@@ -155,26 +342,29 @@ def loop(bodies):
         force = {}
         for body in bodies:
             # Add up all of the forces exerted on 'body'.
-            total_fx = total_fy = 0.0
+            total_fx = total_fy = total_fz = 0.0
             for other in bodies:
                 if body is other:
                     continue
-                fx, fy = body.attraction(other)
+                fx, fy, fz = body.attraction(other)
                 total_fx += fx
                 total_fy += fy
+                total_fz += fz
 
             # Record the total force exerted.
-            force[body] = (total_fx, total_fy)
+            force[body] = (total_fx, total_fy, total_fz)
 
         # Update velocities based upon on the force.
         for body in bodies:
-            fx, fy = force[body]
+            fx, fy, fz = force[body]
             body.vx += fx / body.mass * timestep
             body.vy += fy / body.mass * timestep
+            body.vz += fz / body.mass * timestep
 
             # Update positions
             body.px += body.vx * timestep
             body.py += body.vy * timestep
+            body.pz += body.vz * timestep
 
     print()
     print ('Simulation ran on ' + (str(DAY_STEP * NUM_STEP))+ ' days')
@@ -182,13 +372,12 @@ def loop(bodies):
     for body in bodies:
         print (body.name + ' D(min): ' + str(body.dmin/AU) + ' D(max): ' + str(body.dmax/AU) + ' V(min): ' + str(body.vmin) + ' V(max): ' + str(body.vmax))
 
-def main():
-    sim_start_date = "1822-09-23 00:00:00"
-    #sim_start_date = "1990-09-23 00:00:00"     
-
+def make_bodies(sim_start_date=SIM_START_DATE, planets_file='planets.json', cache=None):
+    # the Sun and the planets at sim_start_date, from Horizons through the
+    # ephemeris cache (their vectors saved to planets_file, unless None)
     print ('Get initial condition for date: ' + sim_start_date)
-    h = Horizon()
-    h.setInitialCondition(sim_start_date)
+    h = Horizon(cache)
+    h.setInitialCondition(sim_start_date, planets_file)
 
     # http://nssdc.gsfc.nasa.gov/planetary/factsheet/venusfact.html
     #
@@ -271,10 +460,112 @@ def main():
     #neptune.vx = 0 * 1000
     #neptune.vy = 5.43 * 1000
 
-    bodies = [sun, mercury, venus, earth, mars, jupiter, saturn, uranus]
-    clean_info_on_file(bodies)
+    return [sun, mercury, venus, earth, mars, jupiter, saturn, uranus]
+
+def bodies_from_checkpoint(checkpoint):
+    # the bodies of a checkpoint.load_checkpoint, instead of the Horizons
+    # initial conditions
+    bodies = []
+    for (i, name) in enumerate(checkpoint['names']):
+        body = Planet()
+        body.name = name
+        body.mass = float(checkpoint['mass'][i])
+        body.px, body.py, body.pz = (float(x) for x in checkpoint['pos'][i])
+        body.vx, body.vy, body.vz = (float(x) for x in checkpoint['vel'][i])
+        bodies.append(body)
+    return bodies
+
+def given_options(parser, keys):
+    """{key: value} of the options of keys given on the command line, not defaulted."""
+    not_given = object()
+    parser.set_defaults(**dict((key, not_given) for key in keys))
+    given, _ = parser.parse_known_args()
+    return dict((key, getattr(given, key)) for key in keys if getattr(given, key) is not not_given)
 
-    loop(bodies)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help="trajectory.csv, trajectory.npy (binary) or the former <Planet>.txt files"
+                             " (default: %(default)s)")
+    parser.add_argument('--outfile', default='trajectory', help="basename of the output (default: %(default)s)")
+    parser.add_argument('--output-days', type=float, default=DAY_STEP,
+                        help="days between two output samples (default: %(default)s, every step)")
+    parser.add_argument('--quiet', action='store_true', help="no per-sample print, only the final summary")
+    parser.add_argument('--integrator', choices=INTEGRATORS, default='euler',
+                        help="euler (the original), leapfrog, yoshida4 or wh, Wisdom-Holman (default: %(default)s)")
+    parser.add_argument('--day-step', type=float, default=DAY_STEP, help="integration step, days (default: %(default)s)")
+    parser.add_argument('--days', type=float,
+                        help="simulated days (default: %d, a revolution of Uranus; with --resume, the checkpoint"
+                             " ones, more extend the run)" % URANUS_REVOLUTION_TIME)
+    parser.add_argument('--particles', help="csv of test particles, heliocentric x,y,z (au), vx,vy,vz (au/day)")
+    parser.add_argument('--population', choices=POPULATIONS, help="random test particles of this family")
+    parser.add_argument('--n-particles', type=int, default=1000, help="size of --population (default: %(default)s)")
+    parser.add_argument('--seed', type=int, help="random seed of --population")
+    parser.add_argument('--gravity', choices=('direct', 'tree'), default='direct',
+                        help="direct summation over all the pairs or a Barnes-Hut octree (default: %(default)s)")
+    parser.add_argument('--theta', type=float, default=THETA,
+                        help="opening angle of --gravity tree, 0 is exact (default: %(default)s)")
+    parser.add_argument('--cache', default=CACHE_FILE, help="Horizons vectors cache (default: %(default)s)")
+    parser.add_argument('--offline', action='store_true',
+                        help="no Horizons query: the vectors from the cache, else from --standin")
+    parser.add_argument('--standin', default='planets.json',
+                        help="vectors of the --offline runs missing from the cache (default: %(default)s)")
+    parser.add_argument('--standin-any-date', action='store_true',
+                        help="use the --standin vectors even when its date is not the start date")
+    parser.add_argument('--checkpoint', help="checkpoint file (.npz), saved every --checkpoint-days and at the end")
+    parser.add_argument('--checkpoint-days', type=float, default=CHECKPOINT_DAYS,
+                        help="days between two checkpoints (default: %(default)s)")
+    parser.add_argument('--resume', help="checkpoint to continue from, with its settings and output files, up to"
+                                         " --days; saved again there unless --checkpoint. Only --days, --quiet"
+                                         " and --checkpoint can differ from the checkpoint settings")
+    args = parser.parse_args()
+    if args.gravity == 'tree' and args.integrator == 'wh':
+        parser.error("the wh integrator computes its own planet-planet kicks, use --gravity direct")
+
+    run = dict(format=args.format, outfile=args.outfile, output_days=args.output_days, integrator=args.integrator,
+               day_step=args.day_step, gravity=args.gravity, theta=args.theta, checkpoint_days=args.checkpoint_days)
+    days = args.days if args.days is not None else URANUS_REVOLUTION_TIME
+    resume = None
+    particles = None
+    if args.resume:
+        resume = load_checkpoint(args.resume)
+        # the settings and particles of the checkpoint: a different one given is an error, not dropped
+        given = given_options(parser, list(run) + ['particles', 'population', 'n_particles', 'seed'])
+        conflicts = ['--%s %s (checkpoint: %s)' % (key.replace('_', '-'), value, resume['config'][key])
+                     for (key, value) in given.items() if key in run and value != resume['config'][key]]
+        conflicts += ['--%s (checkpoint: its own particles)' % key.replace('_', '-') for key in given if key not in run]
+        if conflicts:
+            parser.error('--resume continues with the settings of %s, not %s' % (args.resume, ', '.join(conflicts)))
+        run = dict((key, resume['config'][key]) for key in run)
+        days = args.days if args.days is not None else resume['config']['days']
+        print ('Resume from ' + args.resume + ', day ' + str((resume['step']-1) * run['day_step']))
+        bodies = bodies_from_checkpoint(resume)
+    else:
+        # offline, planets.json is the stand-in: not rewritten
+        cache = open_cache(args.cache, args.offline, args.standin if args.offline else None, args.standin_any_date)
+        bodies = make_bodies(SIM_START_DATE, None if args.offline else 'planets.json', cache)
+        sun, jupiter = bodies[0], bodies[5]
+
+        if args.particles:
+            state = np.loadtxt(args.particles, delimiter=',', ndmin=2)
+            particles = (state[:, :3]*AU, state[:, 3:6]*AU_PER_DAY)
+        elif args.population:
+            particles = population(args.population, args.n_particles, sun.mass, jupiter.position(), args.seed)
+        if particles is not None:
+            # heliocentric to the frame of the bodies
+            particles = (particles[0] + sun.position(), particles[1] + sun.velocity())
+
+    n_samples = len(output_steps(run['output_days'], run['day_step'], days))
+    output = resume['output'] if resume is not None else None
+    with TrajectoryWriter(run['outfile'], [body.name for body in bodies], run['format'], n_samples,
+                          resume=output) as writer:
+        monitor = loop(bodies, writer, run['output_days'], args.quiet, run['integrator'], run['day_step'], days,
+                       run['outfile'] + '_conservation.csv', particles, run['gravity'], run['theta'],
+                       args.checkpoint or args.resume, run['checkpoint_days'], resume,
+                       {'format': run['format'], 'outfile': run['outfile']}, run['outfile'] + '_events.csv')
+    particles = monitor.engine.particles
+    if particles is not None:
+        write_particles(run['outfile'] + '_particles.csv', particles, len(particles.dmin))
     
 if __name__ == '__main__':
     main()